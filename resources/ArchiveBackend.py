@@ -0,0 +1,842 @@
+
+import os
+import zlib
+import shutil
+import hashlib
+import stat
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .TreeWalker import TreeWalker
+from .IoThrottle import IoThrottle, ThrottledFile
+
+
+class ArchiveBackend(object):
+    """
+    Base class for the archive writers used by archive_users. A backend streams a list of user folders straight into
+    a single archive file so the data never has to be staged in a second directory first.
+    """
+    name = None
+    extension = None
+    follow_symlinks = True
+    compression_stats = None
+
+    def __init__(self, walker=None, throttle=None):
+        """
+        :param walker: a TreeWalker to walk the folders with, None for the default one
+        :param throttle: an IoThrottle to draw the bytes read and written from, None for no limit
+        """
+        self.throttle = throttle or IoThrottle()
+        self.walker = walker or TreeWalker(follow_symlinks=self.follow_symlinks, throttle=self.throttle)
+        self.skipped = {}
+
+    def configure(self, config):
+        """
+        Read the settings that only apply to this backend from the config dictionary
+        :param config: the config dictionary
+        :return: None
+        """
+        pass
+
+    def archive_file_name(self, base_name):
+        """
+        Build the archive file name for a base name
+        :param base_name: path to the archive without an extension
+        :return: string
+        """
+        return '{0}{1}'.format(base_name, self.extension)
+
+    def write(self, archive_file, members, sha256=False):
+        """
+        Write folders into an archive file. Every regular file is checksummed while it is streamed into the archive,
+        so the source data is only read once. Anything that could not be read is left out and listed in skipped under
+        its arcname.
+        :param archive_file: path of the archive file to create
+        :param members: a list of (source_path, arcname) tuples
+        :param sha256: also compute a SHA-256 of every file
+        :return: dictionary of arcname to a dictionary of member name to [crc32, sha256 or None]
+        """
+        raise NotImplementedError
+
+    def verify(self, archive_file, checksums, threads=1, skipped=None):
+        """
+        Check a written archive against the checksums returned by write()
+        :param archive_file: path of the archive file to read
+        :param checksums: dictionary returned by write()
+        :param threads: number of threads to use for decompression if the format allows it
+        :param skipped: the skipped paths from write(), they fail the arcname they belong to
+        :return: a VerifyResult object
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def record_skipped(skipped, path, error):
+        """
+        Report a path that could not be archived
+        :param skipped: list of (path, error) tuples of the arcname being written
+        :param path: path that was left out
+        :param error: the exception that caused it
+        :return: None
+        """
+        print("{0} Skipping: {1}".format(error, path))
+        skipped.append((path, str(error)))
+
+    def list_members(self, archive_file, prefix):
+        """
+        List the members of an archive that are under a prefix
+        :param archive_file: path of the archive file to read
+        :param prefix: directory inside the archive, such as '<archive name>/<uid>'
+        :return: a list of (name, size, mtime) tuples
+        """
+        raise NotImplementedError
+
+    def extract_members(self, archive_file, prefix, target_path, threads=1):
+        """
+        Extract the members of an archive that are under a prefix, with the prefix stripped from their names
+        :param archive_file: path of the archive file to read
+        :param prefix: directory inside the archive, such as '<archive name>/<uid>'
+        :param target_path: directory to extract into
+        :param threads: number of threads to use for decompression if the format allows it
+        :return: number of members extracted
+        """
+        raise NotImplementedError
+
+
+class ZipArchiveBackend(ArchiveBackend):
+    """
+    Writes a standard zip file, picking the compression method for each file. Files that are already compressed, by
+    their extension or by how well a sample of their first block compresses, are stored as they are and everything
+    else is deflated, or compressed with lzma or bzip2 if set. Zip can not store dates before 1980, those are
+    written as 1980-01-01 without touching the source data.
+    """
+    name = 'zip'
+    extension = '.zip'
+    compression_methods = {'deflate': zipfile.ZIP_DEFLATED, 'lzma': zipfile.ZIP_LZMA, 'bzip2': zipfile.ZIP_BZIP2}
+
+    def __init__(self, walker=None, throttle=None):
+        ArchiveBackend.__init__(self, walker=walker, throttle=throttle)
+        self.compression = zipfile.ZIP_DEFLATED
+        self.store_extensions = ()
+        self.sample_size = 65536
+        self.sample_ratio = 0.95
+        self.compression_stats = CompressionStats()
+
+    def configure(self, config):
+        try:
+            self.compression = self.compression_methods[config['zip_compression']]
+        except KeyError:
+            raise ValueError("Unknown zip compression: {0}".format(config['zip_compression']))
+        self.store_extensions = tuple(extension.strip().lower() for extension in
+                                      (config['zip_store_extensions'] or '').split(',') if extension.strip())
+        self.sample_size = config['zip_sample_size']
+        self.sample_ratio = config['zip_sample_ratio']
+
+    def write(self, archive_file, members, sha256=False):
+        checksums = {}
+        self.skipped = {}
+        self.compression_stats = CompressionStats()
+        with open(archive_file, 'wb') as out_file, \
+                zipfile.ZipFile(ThrottledFile(file_obj=out_file, throttle=self.throttle), 'w',
+                                compression=zipfile.ZIP_DEFLATED, allowZip64=True, strict_timestamps=False) as zip_file:
+            for source_path, arcname in members:
+                member_checksums = checksums.setdefault(arcname, {})
+                skipped = self.skipped.setdefault(arcname, [])
+                for path, dirs, files in self.walker.walk(
+                        source_path, onerror=lambda p, e: self.record_skipped(skipped=skipped, path=p, error=e)):
+                    arc_path = os.path.normpath(os.path.join(arcname, os.path.relpath(path, source_path)))
+                    try:
+                        zip_file.write(path, arc_path)
+                    except OSError as e:
+                        self.record_skipped(skipped=skipped, path=path, error=e)
+                    for entry in files:
+                        if entry.is_file():
+                            added = self._add_file(zip_file=zip_file, path=entry.path,
+                                                   arcname=os.path.join(arc_path, entry.name), sha256=sha256,
+                                                   skipped=skipped)
+                            if added:
+                                member_checksums[added[0]] = added[1]
+        return checksums
+
+    def _add_file(self, zip_file, path, arcname, sha256=False, skipped=None):
+        """
+        Stream a single file into the zip file, checksumming it on the way. The first block is read before the member
+        is started so it can be used to pick the compression method without reading the file twice. A file that can
+        not be read is recorded as skipped instead of failing the archive, errors writing the archive are raised.
+        :param zip_file: an open ZipFile
+        :param path: path of the file to add
+        :param arcname: name of the file inside the archive
+        :param sha256: also compute a SHA-256 of the file
+        :param skipped: list to add (path, error) to if the file can not be read
+        :return: (member name, [crc32, sha256 or None]), None if the file was skipped
+        """
+        skipped = skipped if skipped is not None else []
+        checksum = MemberChecksum(sha256=sha256)
+        start_time = time.thread_time()
+        try:
+            zip_info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+            in_file = open(path, 'rb')
+        except OSError as e:
+            self.record_skipped(skipped=skipped, path=path, error=e)
+            return None
+        with in_file:
+            in_file = ChecksumReader(in_file=ThrottledFile(file_obj=in_file, throttle=self.throttle), checksum=checksum)
+            try:
+                first_block = in_file.read(self.sample_size or 65536)
+            except OSError as e:
+                self.record_skipped(skipped=skipped, path=path, error=e)
+                return None
+            zip_info.compress_type = self.choose_compression(name=arcname, sample=first_block)
+            sample_time = time.thread_time() - start_time
+            with zip_file.open(zip_info, 'w') as out_file:
+                out_file.write(first_block)
+                # a member can not be taken back out once it is started, a read error leaves it truncated in the
+                # archive but the file is recorded as skipped so its user's data is kept
+                while True:
+                    try:
+                        data = in_file.read(1048576)
+                    except OSError as e:
+                        self.record_skipped(skipped=skipped, path=path, error=e)
+                        return None
+                    if not data:
+                        break
+                    out_file.write(data)
+        self.compression_stats.add(info=zip_info, cpu_time=time.thread_time() - start_time - sample_time,
+                                   sample_time=sample_time)
+        return zip_info.filename, checksum.result()
+
+    def choose_compression(self, name, sample):
+        """
+        Pick the compression method for a file
+        :param name: file name
+        :param sample: the first bytes of the file, empty if the file is empty
+        :return: a zipfile compression constant
+        """
+        if not sample or name.lower().endswith(self.store_extensions):
+            return zipfile.ZIP_STORED
+        # a fast deflate of the sample is a good guess at whether the rest of the file is worth compressing
+        if self.sample_size and self.sample_ratio and len(zlib.compress(sample, 1)) > len(sample) * self.sample_ratio:
+            return zipfile.ZIP_STORED
+        return self.compression
+
+    def verify(self, archive_file, checksums, threads=1, skipped=None):
+        result = VerifyResult()
+        start_time = time.time()
+        for arcname in checksums:
+            result.errors[arcname] = []
+        result.add_skipped(skipped=skipped)
+        try:
+            with open(archive_file, 'rb') as in_file, \
+                    zipfile.ZipFile(ThrottledFile(file_obj=in_file, throttle=self.throttle)) as zip_file:
+                self._verify_members(zip_file=zip_file, checksums=checksums, threads=threads, result=result)
+        except (OSError, zipfile.BadZipFile) as e:
+            # without a readable central directory nothing in the archive can be trusted
+            print("{0} Failed to read archive: {1}".format(e, archive_file))
+            for arcname in checksums:
+                result.errors[arcname].append((archive_file, 'failed to read archive: {0}'.format(e)))
+        result.runtime = time.time() - start_time
+        return result
+
+    def _verify_members(self, zip_file, checksums, threads, result):
+        """
+        Check every member of an open zip file against the checksums taken while it was written
+        :param zip_file: an open ZipFile object
+        :param checksums: dictionary of arcname to {member name: (crc32, sha256 or None)}
+        :param threads: number of threads that decompress members in parallel
+        :param result: the VerifyResult to add to
+        :return: None
+        """
+        # the central directory is checked first, which catches missing members without decompressing anything
+        infos = {info.filename: info for info in zip_file.infolist()}
+        to_read = []
+        for arcname, member_checksums in checksums.items():
+            for name, checksum in member_checksums.items():
+                info = infos.get(name)
+                if info is None:
+                    result.errors[arcname].append((name, 'missing from the central directory'))
+                elif info.CRC != checksum[0]:
+                    result.errors[arcname].append((name, 'CRC in the central directory does not match'))
+                else:
+                    to_read.append((arcname, info, checksum))
+
+        # zipfile checks each member's CRC once it has been read to the end
+        open_lock = threading.Lock()
+
+        def read_member(arcname, info, checksum):
+            member_checksum = MemberChecksum(sha256=checksum[1] is not None)
+            try:
+                with open_lock:
+                    in_file = zip_file.open(info)
+                with in_file:
+                    for data in iter(lambda: in_file.read(1048576), b''):
+                        member_checksum.update(data)
+            except (OSError, zipfile.BadZipFile, zlib.error) as e:
+                return arcname, info.filename, 0, str(e)
+            if member_checksum.result() != checksum:
+                return arcname, info.filename, info.file_size, 'checksum does not match'
+            return arcname, info.filename, info.file_size, None
+
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            for arcname, name, size, error in executor.map(lambda member: read_member(*member), to_read):
+                result.add(arcname=arcname, name=name, size=size, error=error)
+
+    def list_members(self, archive_file, prefix):
+        # only the central directory is read, nothing is decompressed
+        with zipfile.ZipFile(archive_file) as zip_file:
+            return [(info.filename, info.file_size, get_zip_mtime(info)) for info in zip_file.infolist()
+                    if get_member_relative_name(name=info.filename, prefix=prefix) is not None]
+
+    def extract_members(self, archive_file, prefix, target_path, threads=1):
+        target_path = os.path.abspath(target_path)
+        dirs = []
+        files = []
+        with zipfile.ZipFile(archive_file) as zip_file:
+            for info in zip_file.infolist():
+                relative_name = get_member_relative_name(name=info.filename, prefix=prefix)
+                if relative_name is None:
+                    continue
+                dest = get_safe_path(target_path=target_path, name=relative_name)
+                if dest is None:
+                    print("Skipping member outside of the target path: {0}".format(info.filename))
+                elif info.is_dir():
+                    dirs.append((dest, info))
+                else:
+                    files.append((dest, info))
+
+            for dest, info in dirs:
+                os.makedirs(dest, exist_ok=True)
+
+            # members are decompressed in parallel, opening them shares the file handle so it is serialized
+            open_lock = threading.Lock()
+
+            def extract(dest, info):
+                try:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    with open_lock:
+                        in_file = zip_file.open(info)
+                    with in_file, open(dest, 'wb') as out_file:
+                        shutil.copyfileobj(in_file, out_file, 1048576)
+                    set_zip_attributes(path=dest, info=info)
+                    return True
+                except (OSError, zipfile.BadZipFile) as e:
+                    print("{0} Failed to extract member: {1}".format(e, info.filename))
+                    return False
+
+            with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+                extracted = sum(executor.map(lambda member: extract(*member), files))
+
+        # writing files changes the directory mtimes, so set them last and deepest first
+        for dest, info in sorted(dirs, key=lambda member: member[0].count(os.sep), reverse=True):
+            set_zip_attributes(path=dest, info=info)
+        return extracted + len(dirs)
+
+
+class TarArchiveBackend(ArchiveBackend):
+    """
+    Writes a streaming pax tar file, optionally compressed with gzip, xz or bzip2. Ownership and permissions are kept,
+    hardlinked files are stored once and then as links, and sparse files are written as GNU 1.0 sparse members so
+    their holes are neither read nor stored.
+    """
+    name = 'tar'
+    extension = '.tar'
+    compression = ''
+    follow_symlinks = False
+
+    def write(self, archive_file, members, sha256=False):
+        checksums = {}
+        self.skipped = {}
+        mode = 'w|{0}'.format(self.compression)
+        with open(archive_file, 'wb') as out_file:
+            out_file = ThrottledFile(file_obj=out_file, throttle=self.throttle)
+            with tarfile.open(fileobj=out_file, mode=mode, format=tarfile.PAX_FORMAT) as tar_file:
+                for source_path, arcname in members:
+                    # hardlinks are only stored as links within a user, so every user can be restored on their own
+                    tar_file.inodes.clear()
+                    member_checksums = checksums.setdefault(arcname, {})
+                    skipped = self.skipped.setdefault(arcname, [])
+                    for path, dirs, files in self.walker.walk(
+                            source_path, onerror=lambda p, e: self.record_skipped(skipped=skipped, path=p, error=e)):
+                        arc_path = os.path.normpath(os.path.join(arcname, os.path.relpath(path, source_path)))
+                        self._add(tar_file=tar_file, path=path, arcname=arc_path, skipped=skipped)
+                        for entry in dirs:
+                            # symlinks to directories are not walked, store them as links
+                            if entry.is_symlink():
+                                self._add(tar_file=tar_file, path=entry.path,
+                                          arcname=os.path.join(arc_path, entry.name), skipped=skipped)
+                        for entry in files:
+                            added = self._add(tar_file=tar_file, path=entry.path,
+                                              arcname=os.path.join(arc_path, entry.name), sha256=sha256,
+                                              throttle=self.throttle, skipped=skipped)
+                            if added:
+                                member_checksums[added[0]] = added[1]
+        return checksums
+
+    def verify(self, archive_file, checksums, threads=1, skipped=None):
+        # tar has no index, the archive is read once from start to end and threads are not used
+        result = VerifyResult()
+        start_time = time.time()
+        expected = {}
+        for arcname, member_checksums in checksums.items():
+            result.errors[arcname] = []
+            for name, checksum in member_checksums.items():
+                expected[name] = (arcname, checksum)
+        result.add_skipped(skipped=skipped)
+        try:
+            with open(archive_file, 'rb') as in_file:
+                in_file = ThrottledFile(file_obj=in_file, throttle=self.throttle)
+                with tarfile.open(fileobj=in_file, mode='r:*') as tar_file:
+                    for member in tar_file:
+                        if not member.isreg() or member.name not in expected:
+                            continue
+                        arcname, checksum = expected.pop(member.name)
+                        member_checksum = MemberChecksum(sha256=checksum[1] is not None)
+                        with tar_file.extractfile(member) as member_file:
+                            for data in iter(lambda: member_file.read(1048576), b''):
+                                member_checksum.update(data)
+                        error = None if member_checksum.result() == checksum else 'checksum does not match'
+                        result.add(arcname=arcname, name=member.name, size=member.size, error=error)
+        except (OSError, EOFError, tarfile.TarError, zlib.error) as e:
+            print("{0} Failed to read archive: {1}".format(e, archive_file))
+            for arcname in checksums:
+                result.errors[arcname].append((archive_file, 'failed to read archive: {0}'.format(e)))
+        # anything not seen is missing, including everything after a read error
+        for name, (arcname, checksum) in expected.items():
+            result.errors[arcname].append((name, 'missing from the archive'))
+        result.runtime = time.time() - start_time
+        return result
+
+    def list_members(self, archive_file, prefix):
+        # tar has no index, compressed archives have to be decompressed up to the last member
+        with tarfile.open(archive_file, 'r:*') as tar_file:
+            return [(member.name, member.size, member.mtime) for member in tar_file
+                    if get_member_relative_name(name=member.name, prefix=prefix) is not None]
+
+    def extract_members(self, archive_file, prefix, target_path, threads=1):
+        target_path = os.path.abspath(target_path)
+        extract_args = {'numeric_owner': True}
+        if hasattr(tarfile, 'tar_filter'):
+            extract_args['filter'] = 'tar'
+        extracted = 0
+        dirs = []
+        with tarfile.open(archive_file, 'r:*') as tar_file:
+            for member in tar_file:
+                relative_name = get_member_relative_name(name=member.name, prefix=prefix)
+                if relative_name is None:
+                    continue
+                member.name = relative_name or '.'
+                if member.islnk():
+                    member.linkname = get_member_relative_name(name=member.linkname, prefix=prefix)
+                    if not member.linkname:
+                        print("Skipping hardlink to a member of another user: {0}".format(member.name))
+                        continue
+                try:
+                    if member.isdir():
+                        tar_file.extract(member, path=target_path, set_attrs=False, **extract_args)
+                        dirs.append(member)
+                    else:
+                        tar_file.extract(member, path=target_path, **extract_args)
+                    extracted += 1
+                except (OSError, tarfile.TarError) as e:
+                    print("{0} Failed to extract member: {1}".format(e, member.name))
+
+            # writing files changes the directory mtimes, so set them last and deepest first like extractall does
+            for member in sorted(dirs, key=lambda dir_member: os.path.normpath(dir_member.name).count(os.sep),
+                                 reverse=True):
+                dir_path = os.path.join(target_path, member.name)
+                try:
+                    if hasattr(tarfile, 'tar_filter'):
+                        member = tarfile.tar_filter(member, target_path)
+                    tar_file.chown(member, dir_path, numeric_owner=True)
+                    tar_file.utime(member, dir_path)
+                    tar_file.chmod(member, dir_path)
+                except (OSError, tarfile.TarError) as e:
+                    print("{0} Failed to set directory attributes: {1}".format(e, member.name))
+        return extracted
+
+    @staticmethod
+    def _add(tar_file, path, arcname, sha256=False, throttle=None, skipped=None):
+        """
+        Add a single file system entry to the tar file without recursing, checksumming regular files on the way
+        :param tar_file: an open TarFile
+        :param path: path of the entry to add
+        :param arcname: name of the entry inside the archive
+        :param sha256: also compute a SHA-256 of regular files
+        :param throttle: an IoThrottle to draw the bytes read from, None for no limit
+        :param skipped: list to add (path, error) to if the entry can not be read
+        :return: (member name, [crc32, sha256 or None]) for regular files, otherwise None
+        """
+        skipped = skipped if skipped is not None else []
+        try:
+            tar_info = tar_file.gettarinfo(name=path, arcname=arcname)
+        except (FileNotFoundError, OSError) as e:
+            ArchiveBackend.record_skipped(skipped=skipped, path=path, error=e)
+            return None
+        if tar_info is None:
+            # sockets and other unsupported types
+            return
+        if not tar_info.isreg():
+            tar_file.addfile(tar_info)
+            return
+        name = tar_info.name
+        checksum = MemberChecksum(sha256=sha256)
+        try:
+            with open(path, 'rb') as in_file:
+                in_file = ThrottledFile(file_obj=in_file, throttle=throttle or IoThrottle())
+                sparse_map = get_sparse_map(in_file=in_file, file_size=tar_info.size)
+                if sparse_map is None:
+                    tar_file.addfile(tar_info, ChecksumReader(in_file=in_file, checksum=checksum))
+                else:
+                    tar_file.addfile(*sparse_tar_member(tar_info=tar_info, in_file=in_file, sparse_map=sparse_map,
+                                                        checksum=checksum))
+        except (FileNotFoundError, PermissionError) as e:
+            ArchiveBackend.record_skipped(skipped=skipped, path=path, error=e)
+            return None
+        return name, checksum.result()
+
+
+class GzipTarArchiveBackend(TarArchiveBackend):
+    name = 'gztar'
+    extension = '.tar.gz'
+    compression = 'gz'
+
+
+class Bzip2TarArchiveBackend(TarArchiveBackend):
+    name = 'bztar'
+    extension = '.tar.bz2'
+    compression = 'bz2'
+
+
+class XzTarArchiveBackend(TarArchiveBackend):
+    name = 'xztar'
+    extension = '.tar.xz'
+    compression = 'xz'
+
+
+archive_backends = {backend.name: backend for backend in (ZipArchiveBackend, TarArchiveBackend, GzipTarArchiveBackend,
+                                                          Bzip2TarArchiveBackend, XzTarArchiveBackend)}
+
+
+def get_archive_backend(name):
+    """
+    Look up an archive backend by its config name
+    :param name: zip | tar | gztar | bztar | xztar
+    :return: an ArchiveBackend object
+    """
+    try:
+        return archive_backends[name]()
+    except KeyError:
+        raise ValueError("Unknown archive format: {0}".format(name))
+
+
+def get_archive_extensions():
+    """
+    Get the file extensions of all archive backends, longest first so '.tar.gz' is matched before '.tar'
+    :return: a list of strings
+    """
+    return sorted([backend.extension for backend in archive_backends.values()], key=len, reverse=True)
+
+
+def get_archive_backend_for_file(archive_file):
+    """
+    Look up the archive backend that wrote an archive file from its extension
+    :param archive_file: path or name of an archive file
+    :return: an ArchiveBackend object
+    """
+    for backend in sorted(archive_backends.values(), key=lambda b: len(b.extension), reverse=True):
+        if archive_file.endswith(backend.extension):
+            return backend()
+    raise ValueError("Unknown archive extension: {0}".format(archive_file))
+
+
+def get_member_relative_name(name, prefix):
+    """
+    Get the name of an archive member relative to a prefix directory
+    :param name: name of the member inside the archive
+    :param prefix: directory inside the archive
+    :return: string, '' for the prefix directory itself, or None if the member is not under the prefix
+    """
+    name = name.rstrip('/')
+    prefix = prefix.rstrip('/')
+    if name == prefix:
+        return ''
+    if name.startswith(prefix + '/'):
+        return name[len(prefix) + 1:]
+    return None
+
+
+def get_safe_path(target_path, name):
+    """
+    Join a member name onto the target path, refusing names that would land outside of it
+    :param target_path: absolute path of the directory being extracted into
+    :param name: relative member name
+    :return: string or None
+    """
+    dest = os.path.normpath(os.path.join(target_path, name))
+    if dest != target_path and not dest.startswith(target_path + os.sep):
+        return None
+    return dest
+
+
+def get_zip_mtime(info):
+    """
+    Convert the local date_time of a zip member into a timestamp
+    :param info: a ZipInfo object
+    :return: float
+    """
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def set_zip_attributes(path, info):
+    """
+    Restore the permissions and modification time stored for a zip member
+    :param path: path of the extracted member
+    :param info: a ZipInfo object
+    :return: None
+    """
+    mode = info.external_attr >> 16
+    if mode:
+        os.chmod(path, stat.S_IMODE(mode))
+    mtime = get_zip_mtime(info)
+    os.utime(path, (mtime, mtime))
+
+
+def get_sparse_map(in_file, file_size):
+    """
+    Find the data regions of a sparse file
+    :param in_file: file object opened for reading
+    :param file_size: size of the file in bytes
+    :return: a list of (offset, length) tuples, or None if the file is not sparse
+    """
+    if not hasattr(os, 'SEEK_DATA') or file_size == 0:
+        return None
+    if os.fstat(in_file.fileno()).st_blocks * 512 >= file_size:
+        return None
+
+    sparse_map = []
+    fd = in_file.fileno()
+    offset = 0
+    try:
+        while offset < file_size:
+            try:
+                data_start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError:
+                # no more data, the rest of the file is a hole
+                break
+            data_end = os.lseek(fd, data_start, os.SEEK_HOLE)
+            sparse_map.append((data_start, data_end - data_start))
+            offset = data_end
+    except OSError:
+        # file system does not support hole detection
+        return None
+    finally:
+        os.lseek(fd, 0, os.SEEK_SET)
+
+    # the map always ends with an empty region at the end of the file
+    sparse_map.append((file_size, 0))
+    return sparse_map
+
+
+def sparse_tar_member(tar_info, in_file, sparse_map, checksum=None):
+    """
+    Turn a regular file's TarInfo into a GNU 1.0 sparse member
+    :param tar_info: TarInfo of the regular file
+    :param in_file: file object opened for reading
+    :param sparse_map: data regions from get_sparse_map()
+    :param checksum: a MemberChecksum to update with the file's contents, holes included
+    :return: (TarInfo, file object) to pass to TarFile.addfile()
+    """
+    map_text = '{0}\n'.format(len(sparse_map))
+    for offset, length in sparse_map:
+        map_text += '{0}\n{1}\n'.format(offset, length)
+    map_block = map_text.encode('ascii')
+    map_block += b'\0' * (-len(map_block) % tarfile.BLOCKSIZE)
+
+    real_name = tar_info.name
+    head, tail = os.path.split(real_name)
+    tar_info.pax_headers = dict(tar_info.pax_headers)
+    tar_info.pax_headers['GNU.sparse.major'] = '1'
+    tar_info.pax_headers['GNU.sparse.minor'] = '0'
+    tar_info.pax_headers['GNU.sparse.name'] = real_name
+    tar_info.pax_headers['GNU.sparse.realsize'] = str(tar_info.size)
+    tar_info.name = os.path.join(head, 'GNUSparseFile.0', tail)
+    tar_info.size = len(map_block) + sum(length for offset, length in sparse_map)
+    return tar_info, SparseFileReader(in_file=in_file, map_block=map_block, sparse_map=sparse_map, checksum=checksum)
+
+
+class SparseFileReader(object):
+    """
+    File-like object that yields a sparse map block followed by only the data regions of a file
+    """
+
+    def __init__(self, in_file, map_block, sparse_map, checksum=None):
+        self.in_file = in_file
+        self.map_block = map_block
+        self.regions = [region for region in sparse_map if region[1]]
+        self.checksum = checksum
+        self.position = 0
+        self.file_size = sparse_map[-1][0]
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            if self.map_block:
+                data = self.map_block[:size]
+                self.map_block = self.map_block[size:]
+            elif self.regions:
+                offset, length = self.regions[0]
+                read_size = min(size, length)
+                self.in_file.seek(offset)
+                data = self.in_file.read(read_size)
+                # pad with zeros if the file shrank while we were reading it
+                data += b'\0' * (read_size - len(data))
+                if self.checksum:
+                    # the checksum covers the file as it will be extracted, so the holes count as zeros
+                    self.checksum.update_zeros(length=offset - self.position)
+                    self.checksum.update(data)
+                    self.position = offset + read_size
+                if read_size == length:
+                    self.regions.pop(0)
+                else:
+                    self.regions[0] = (offset + read_size, length - read_size)
+            else:
+                break
+            chunks.append(data)
+            size -= len(data)
+        if self.checksum and not self.map_block and not self.regions and self.position < self.file_size:
+            self.checksum.update_zeros(length=self.file_size - self.position)
+            self.position = self.file_size
+        return b''.join(chunks)
+
+
+class MemberChecksum(object):
+    """
+    Running CRC32, and optionally SHA-256, of a single archive member
+    """
+    zero_block = bytes(1048576)
+
+    def __init__(self, sha256=False):
+        self.crc32 = 0
+        self.sha256 = hashlib.sha256() if sha256 else None
+
+    def update(self, data):
+        self.crc32 = zlib.crc32(data, self.crc32)
+        if self.sha256:
+            self.sha256.update(data)
+
+    def update_zeros(self, length):
+        while length > 0:
+            data = self.zero_block[:length] if length < len(self.zero_block) else self.zero_block
+            self.update(data)
+            length -= len(data)
+
+    def result(self):
+        """
+        :return: [crc32, sha256 hex digest or None]
+        """
+        return [self.crc32, self.sha256.hexdigest() if self.sha256 else None]
+
+
+class ChecksumReader(object):
+    """
+    File-like object that updates a MemberChecksum with everything read through it
+    """
+
+    def __init__(self, in_file, checksum):
+        self.in_file = in_file
+        self.checksum = checksum
+
+    def read(self, size=-1):
+        data = self.in_file.read(size)
+        self.checksum.update(data)
+        return data
+
+
+class CompressionStats(object):
+
+    def __init__(self):
+        """
+        Totals of the files a zip file was written with, split by whether they were stored or compressed
+        """
+        self.stored_files = 0
+        self.stored_bytes = 0
+        self.stored_time = 0
+        self.compressed_files = 0
+        self.compressed_bytes = 0
+        self.compressed_size = 0
+        self.compressed_time = 0
+        self.sample_time = 0
+
+    def add(self, info, cpu_time, sample_time=0):
+        """
+        Record a written member
+        :param info: the ZipInfo of the member
+        :param cpu_time: CPU seconds spent writing the member
+        :param sample_time: CPU seconds spent reading the first block and picking the compression method
+        :return: None
+        """
+        self.sample_time += sample_time
+        if info.compress_type == zipfile.ZIP_STORED:
+            self.stored_files += 1
+            self.stored_bytes += info.file_size
+            self.stored_time += cpu_time
+        else:
+            self.compressed_files += 1
+            self.compressed_bytes += info.file_size
+            self.compressed_size += info.compress_size
+            self.compressed_time += cpu_time
+
+    def get_time_saved(self):
+        """
+        Estimate the CPU time saved by storing files, from the CPU time per byte of the files that were compressed
+        :return: seconds
+        """
+        if not self.compressed_bytes or not self.stored_bytes:
+            return 0
+        compressed_rate = self.compressed_time / self.compressed_bytes
+        stored_rate = self.stored_time / self.stored_bytes
+        return max(0, (compressed_rate - stored_rate) * self.stored_bytes - self.sample_time)
+
+
+class VerifyResult(object):
+
+    def __init__(self):
+        """
+        Outcome of checking an archive against the checksums recorded while it was written
+        """
+        self.members = 0
+        self.bytes = 0
+        self.errors = {}
+        self.runtime = 0
+
+    def add(self, arcname, name, size, error=None):
+        """
+        Record a member that was read back
+        :param arcname: the folder arcname the member belongs to
+        :param name: member name
+        :param size: uncompressed bytes read
+        :param error: description of what is wrong with the member, None if it matched
+        :return: None
+        """
+        self.members += 1
+        self.bytes += size
+        if error:
+            self.errors.setdefault(arcname, []).append((name, error))
+
+    def add_skipped(self, skipped):
+        """
+        Fail the arcnames that had paths left out while the archive was written
+        :param skipped: dictionary of arcname to a list of (path, error) tuples, or None
+        :return: None
+        """
+        for arcname, paths in (skipped or {}).items():
+            self.errors.setdefault(arcname, []).extend((path, 'not archived: {0}'.format(error))
+                                                       for path, error in paths)
+
+    def passed(self, arcname):
+        """
+        :param arcname: the folder arcname passed to write()
+        :return: True if nothing under it was left out and every member was read back and matched
+        """
+        return arcname in self.errors and not self.errors[arcname]
@@ -0,0 +1,149 @@
+
+import datetime
+import threading
+from time import sleep
+from time import monotonic
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate=None):
+        """
+        Token bucket shared by every thread that draws from it. Up to one second of tokens can build up while it is
+        not used. Callers take tokens before doing the work and sleep off any debt, so a single large request is
+        allowed through and paid for afterwards.
+        :param rate: tokens per second, None for no limit
+        """
+        self.rate = rate
+        self.tokens = rate or 0
+        self.last = monotonic()
+        self.lock = threading.Lock()
+        self.total = 0
+        self.wait_time = 0
+
+    def set_rate(self, rate):
+        with self.lock:
+            if rate != self.rate:
+                self.rate = rate
+                self.tokens = min(self.tokens, rate) if rate else 0
+                self.last = monotonic()
+
+    def take(self, amount):
+        """
+        Take tokens from the bucket, sleeping until the rate allows it
+        :param amount: number of tokens
+        :return: seconds waited
+        """
+        with self.lock:
+            self.total += amount
+            if not self.rate:
+                return 0
+            now = monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate) - amount
+            self.last = now
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.wait_time += wait
+        if wait:
+            sleep(wait)
+        return wait
+
+
+class IoThrottle(object):
+
+    def __init__(self, read_limit=None, write_limit=None, metadata_limit=None, schedule=None):
+        """
+        Limits the read bytes, write bytes and metadata operations per second of everything that walks, reads,
+        writes or removes user data, so runs can go on during the day at a rate the file server can take. The
+        limits are shared by all threads of a run.
+        :param read_limit: read bytes per second, None for no limit
+        :param write_limit: written bytes per second, None for no limit
+        :param metadata_limit: directory reads, stats, unlinks and rmdirs per second, None for no limit
+        :param schedule: a list of dictionaries with a 'start' and 'end' time of day as HH:MM and any of 'read',
+            'write' and 'metadata' limits to use instead between those times
+        """
+        self.limits = {'read': read_limit, 'write': write_limit, 'metadata': metadata_limit}
+        self.schedule = schedule or []
+        self.buckets = {kind: TokenBucket(rate=limit) for kind, limit in self.limits.items()}
+        self.start_time = monotonic()
+        self.checked_minute = None
+        self.schedule_lock = threading.Lock()
+
+    def read(self, size):
+        return self.take(kind='read', amount=size)
+
+    def write(self, size):
+        return self.take(kind='write', amount=size)
+
+    def metadata(self, count=1):
+        return self.take(kind='metadata', amount=count)
+
+    def take(self, kind, amount):
+        """
+        Draw from one of the budgets
+        :param kind: read | write | metadata
+        :param amount: bytes or operations
+        :return: seconds waited
+        """
+        if self.schedule:
+            self.apply_schedule()
+        return self.buckets[kind].take(amount=amount)
+
+    def apply_schedule(self):
+        """
+        Switch the limits when the time of day moves into or out of a schedule window, checked once a minute
+        :return: None
+        """
+        now = datetime.datetime.today()
+        minute = now.hour * 60 + now.minute
+        if minute == self.checked_minute:
+            return
+        with self.schedule_lock:
+            self.checked_minute = minute
+            limits = dict(self.limits)
+            for window in self.schedule:
+                start = get_minute_of_day(window['start'])
+                end = get_minute_of_day(window['end'])
+                # windows may wrap around midnight
+                if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                    limits.update({kind: window[kind] for kind in limits if kind in window})
+            for kind, limit in limits.items():
+                self.buckets[kind].set_rate(rate=limit)
+
+    def get_stats(self):
+        """
+        :return: dictionary of read | write | metadata to (total, achieved rate per second, seconds waited)
+        """
+        run_time = max(monotonic() - self.start_time, 0.001)
+        return {kind: (bucket.total, bucket.total / run_time, bucket.wait_time)
+                for kind, bucket in self.buckets.items()}
+
+
+class ThrottledFile(object):
+    """
+    File-like object that draws the bytes read from or written to a file from an IoThrottle
+    """
+
+    def __init__(self, file_obj, throttle):
+        self.file_obj = file_obj
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.throttle.read(size=len(data))
+        return data
+
+    def write(self, data):
+        self.throttle.write(size=len(data))
+        return self.file_obj.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file_obj, name)
+
+
+def get_minute_of_day(time_of_day):
+    """
+    :param time_of_day: string as HH:MM
+    :return: minutes since midnight
+    """
+    hour, minute = [int(part) for part in time_of_day.split(':')]
+    return hour * 60 + minute
@@ -0,0 +1,284 @@
+
+import os
+import copy
+import json
+import queue
+import socket
+import datetime
+import threading
+import socketserver
+from time import time
+
+from SimpleLdapLib import SimpleLdap
+from .RetentionRun import RetentionRun, RetentionRunError
+from .RetentionPolicy import RetentionPolicy
+
+
+class RetentionDaemon(object):
+
+    def __init__(self, config, ldap_config):
+        """
+        Long running retention enforcer. Keeps ldap connections bound and the looked up users, folder sizes and
+        retention policy in memory so status and plan requests on the local socket are answered without a cold start.
+        Archive runs are started at daemon_run_time every day.
+        :param config: the config dictionary
+        :param ldap_config: the ldap config dictionary
+        """
+        self.config = config
+        self.ldap_config = ldap_config
+        self.policy = RetentionPolicy(config=config)
+        self.size_index = {}
+        self.users = {}
+        self.users_lock = threading.Lock()
+        self.ldap_pool = queue.Queue()
+        self.run_thread = None
+        self.run_lock = threading.Lock()
+        self.last_run = None
+        self.stop_event = threading.Event()
+        self.server = None
+
+    def start(self):
+        """
+        Bind the ldap pool, start the scheduler and serve requests until stopped
+        :return: None
+        """
+        for _ in range(self.config['daemon_ldap_connections']):
+            self.ldap_pool.put(self.bind_ldap())
+
+        socket_path = self.config['daemon_socket_path']
+        try:
+            os.remove(socket_path)
+        except FileNotFoundError:
+            pass
+        self.server = socketserver.ThreadingUnixStreamServer(socket_path, self.make_handler())
+        self.server.daemon_threads = True
+        os.chmod(socket_path, 0o600)
+
+        if self.config['daemon_run_time']:
+            threading.Thread(target=self.schedule_runs, daemon=True).start()
+
+        print('Listening on {0}'.format(socket_path))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stop_event.set()
+            self.server.server_close()
+            os.remove(socket_path)
+            while not self.ldap_pool.empty():
+                self.ldap_pool.get().unbind_server()
+
+    def bind_ldap(self):
+        """
+        Bind a new ldap connection
+        :return: a bound SimpleLdap object
+        """
+        ldap_d = SimpleLdap()
+        ldap_d.config = self.ldap_config
+        if not ldap_d.bind_server():
+            raise RetentionRunError("Failed to bind to ldap server.")
+        return ldap_d
+
+    def rebind_ldap(self, ldap_d):
+        """
+        Replace a connection that failed with a newly bound one. If the ldap server can not be reached the old
+        connection is kept so the pool does not shrink, it is replaced again the next time it fails.
+        :param ldap_d: the SimpleLdap object that failed
+        :return: a SimpleLdap object to put back in the pool
+        """
+        try:
+            ldap_d.unbind_server()
+        except Exception:
+            pass
+        try:
+            return self.bind_ldap()
+        except Exception as e:
+            print("{0} Failed to rebind ldap connection...".format(e))
+            return ldap_d
+
+    def make_handler(self):
+        """
+        Build the request handler class for the socket server. Each request is one line of json and gets one line of
+        json back.
+        :return: a StreamRequestHandler class
+        """
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                # every request gets an answer, a failed request must not leave the client waiting on a closed socket
+                try:
+                    request = json.loads(self.rfile.readline().decode())
+                    response = daemon.handle_request(request=request)
+                    response = json.dumps(response, default=str)
+                except Exception as e:
+                    response = json.dumps({'error': '{0}: {1}'.format(type(e).__name__, e)})
+                try:
+                    self.wfile.write((response + '\n').encode())
+                except OSError as e:
+                    print("{0} Failed to answer request...".format(e))
+
+        return Handler
+
+    def handle_request(self, request):
+        """
+        Answer a single request
+        :param request: dictionary with a 'command' of status, plan or run
+        :return: dictionary
+        """
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a json object")
+        command = request.get('command')
+        if command == 'status':
+            return self.status(uid=request['uid'])
+        elif command == 'plan':
+            return self.plan()
+        elif command == 'run':
+            return {'started': self.start_run()}
+        raise ValueError("Unknown command: {0}".format(command))
+
+    def status(self, uid):
+        """
+        Get the retention status of a single user. The user's ldap information is cached until their data directory
+        changes or daemon_cache_seconds pass.
+        :param uid: User ID
+        :return: dictionary
+        """
+        folder_path = '{0}/{1}'.format(self.config['student_data_path'], uid)
+        try:
+            modify_date = datetime.datetime.fromtimestamp(os.stat(folder_path).st_mtime)
+        except (FileNotFoundError, OSError):
+            return {'uid': uid, 'error': 'No data directory for user'}
+
+        with self.users_lock:
+            cached = self.users.get(uid)
+        from_cache = bool(cached and cached[0].modify_date == modify_date and
+                          time() - cached[1] < self.config['daemon_cache_seconds'])
+        if from_cache:
+            user = cached[0]
+        else:
+            ldap_d = self.ldap_pool.get()
+            try:
+                user = RetentionRun(config=self.config, ldap_config=self.ldap_config, ldap=ldap_d,
+                                    policy=self.policy).lookup_user(ldap_d=ldap_d, uid=uid)
+            except Exception:
+                ldap_d = self.rebind_ldap(ldap_d=ldap_d)
+                raise
+            finally:
+                self.ldap_pool.put(ldap_d)
+            with self.users_lock:
+                self.users[uid] = (user, time())
+
+        user.user_status = self.policy.determine_user_status(user=user)
+        archive_date = self.policy.determine_user_archive_date(user=user) if user.user_status else None
+        size = self.size_index.get(uid)
+        return {'uid': uid,
+                'full_name': user.full_name,
+                'keep': user.user_status,
+                'archive_date': archive_date,
+                'folder_size': size[1] if size and size[0] == user.modify_date else None,
+                'cached': from_cache}
+
+    def plan(self):
+        """
+        Work out which of the known users would be archived right now, from memory. Users whose folders have not been
+        sized yet are listed in users_not_sized and left out of the archive size and the archives.
+        :return: dictionary
+        """
+        with self.users_lock:
+            users = [user for user, looked_up in self.users.values()]
+        users_to_archive = []
+        sized_users = []
+        archive_size = 0
+        for user in users:
+            if not self.policy.determine_user_status(user=user):
+                users_to_archive.append(user)
+                size = self.size_index.get(user.uid)
+                if size:
+                    # the cached users are shared with status requests and runs, so the plan sizes copies of them
+                    sized_user = copy.copy(user)
+                    sized_user.folder_size = size[1]
+                    archive_size += sized_user.folder_size
+                    sized_users.append(sized_user)
+        users_to_archive.sort(key=lambda u: u.uid)
+        sized_users.sort(key=lambda u: u.uid)
+        run = RetentionRun(config=self.config, ldap_config=self.ldap_config, policy=self.policy)
+        chunks, chunk_sizes = run.divide_users_on_directory_size(users=sized_users)
+        return {'users_known': len(users),
+                'users_to_archive': [user.uid for user in users_to_archive],
+                'users_not_sized': sorted(set(user.uid for user in users_to_archive) -
+                                          set(user.uid for user in sized_users)),
+                'archive_size': '{0} MB'.format(round(archive_size, 3)),
+                'archives': [[user.uid for user in chunk] for chunk in chunks],
+                'last_run': self.last_run}
+
+    def start_run(self):
+        """
+        Start an archive run in the background unless one is already running
+        :return: True if a run was started
+        """
+        with self.run_lock:
+            if self.run_thread and self.run_thread.is_alive():
+                return False
+            self.run_thread = threading.Thread(target=self.run, daemon=True)
+            self.run_thread.start()
+            return True
+
+    def run(self):
+        """
+        Do a full archive run with a connection from the ldap pool and remember the users it looked up
+        :return: None
+        """
+        ldap_d = self.ldap_pool.get()
+        try:
+            run = RetentionRun(config=self.config, ldap_config=self.ldap_config, ldap=ldap_d, policy=self.policy,
+                               size_index=self.size_index)
+            run.run(interactive=False)
+        except RetentionRunError as e:
+            ldap_d = self.rebind_ldap(ldap_d=ldap_d)
+            print("{0} Run failed...".format(e))
+            return
+        except Exception:
+            ldap_d = self.rebind_ldap(ldap_d=ldap_d)
+            raise
+        finally:
+            self.ldap_pool.put(ldap_d)
+
+        looked_up = time()
+        with self.users_lock:
+            for user in run.users:
+                self.users[user.uid] = (user, looked_up)
+            for user in run.users_to_archive:
+                if not os.path.exists(user.folder_path):
+                    self.users.pop(user.uid, None)
+                    self.size_index.pop(user.uid, None)
+        self.last_run = datetime.datetime.today()
+
+    def schedule_runs(self):
+        """
+        Start an archive run every day at daemon_run_time
+        :return: None
+        """
+        hour, minute = [int(part) for part in self.config['daemon_run_time'].split(':')]
+        while not self.stop_event.is_set():
+            now = datetime.datetime.today()
+            next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += datetime.timedelta(days=1)
+            if self.stop_event.wait(timeout=(next_run - now).total_seconds()):
+                return
+            if not self.start_run():
+                print('Skipping scheduled run, the last run is still going...')
+
+
+def query_daemon(socket_path, request):
+    """
+    Send a request to a running daemon
+    :param socket_path: path of the daemon's unix socket
+    :param request: dictionary with a 'command' and its arguments
+    :return: dictionary
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(request) + '\n').encode())
+        with client.makefile('r') as response:
+            return json.loads(response.readline())
@@ -0,0 +1,143 @@
+
+import calendar
+import datetime
+
+
+class RetentionPolicy(object):
+
+    def __init__(self, config):
+        """
+        Decides whether a user's data should be kept, using the retention months from the config
+        :param config: the config dictionary
+        """
+        self.config = config
+
+    def determine_user_status(self, user):
+        """
+        Determines if a user's data should be kept or not
+        :param user: A User object
+        :return: True - user's data should be kept | False - user's data should be deleted
+        """
+        if user.wmu_enrolled:
+            return True
+        elif user.wmu_enrolled == None:
+            if not user.inet_user_status:
+                return False
+            else:
+                return self.determine_user_status_not_enrolled(user=user)
+        else:
+            return self.determine_user_status_not_enrolled(user=user)
+
+    def determine_user_status_not_enrolled(self, user):
+        """
+        Determines if a user's data should be kept or not starting at the student expiration point on the tree
+        Should only be called from determine_user_status()
+        :param user: A User object
+        :return: True - user's data should be kept | False - user's data should be deleted
+        """
+        # student expiration object is none
+        if not user.wmu_student_expiration:
+
+            # employee expiration object is none
+            if not user.wmu_employee_expiration:
+
+                # check modification date
+                return self.check_expiration(expiration_date=user.modify_date,
+                                             retention_months=self.config['data_retention_months_after_access'])
+
+            # employee expiration object exists
+            else:
+
+                # return expiration status
+                return self.check_expiration(expiration_date=user.wmu_employee_expiration,
+                                             retention_months=self.config['data_retention_months_after_expiration'])
+
+        # student expiration object exists
+        else:
+
+            # student expiration is within retention
+            if self.check_expiration(expiration_date=user.wmu_student_expiration,
+                                     retention_months=self.config['data_retention_months_after_expiration']):
+                return True
+
+            # student expiration is out of retention
+            else:
+
+                # employee expiration object is none
+                if not user.wmu_employee_expiration:
+                    return False
+
+                # employee expiration object exists
+                else:
+
+                    # return expiration status
+                    return self.check_expiration(expiration_date=user.wmu_employee_expiration,
+                                                 retention_months=self.config['data_retention_months_after_expiration'])
+
+    def determine_user_archive_date(self, user):
+        """
+        Determines the earliest date that a kept user's data could be archived if nothing about them changes.
+        Follows the same tree as determine_user_status().
+        :param user: A User object
+        :return: datetime object | None if there is no known date, such as for enrolled users
+        """
+        if user.wmu_enrolled:
+            return None
+        elif user.wmu_enrolled == None and not user.inet_user_status:
+            return datetime.datetime.today()
+
+        months_after_expiration = self.config['data_retention_months_after_expiration']
+        months_after_access = self.config['data_retention_months_after_access']
+
+        # student expiration object is none
+        if not user.wmu_student_expiration:
+
+            # employee expiration object is none
+            if not user.wmu_employee_expiration:
+                retention_end = self.get_retention_end(expiration_date=user.modify_date,
+                                                       retention_months=months_after_access)
+            else:
+                retention_end = self.get_retention_end(expiration_date=user.wmu_employee_expiration,
+                                                       retention_months=months_after_expiration)
+
+        # student expiration object exists, the employee expiration takes over once it is out of retention
+        else:
+            retention_end = self.get_retention_end(expiration_date=user.wmu_student_expiration,
+                                                   retention_months=months_after_expiration)
+            if user.wmu_employee_expiration:
+                retention_end = max(retention_end,
+                                    self.get_retention_end(expiration_date=user.wmu_employee_expiration,
+                                                           retention_months=months_after_expiration))
+
+        # check_expiration() stops reporting within retention one day before the retention end
+        return retention_end - datetime.timedelta(days=1)
+
+    @staticmethod
+    def get_retention_end(expiration_date, retention_months):
+        """
+        Adds retention months to an expiration date
+        :param expiration_date: Date something expires
+        :param retention_months: Number of months past the expiration the retention lasts
+        :return: datetime object
+        """
+        month = expiration_date.month - 1 + retention_months
+        year = expiration_date.year + month // 12
+        month = month % 12 + 1
+        day = min(expiration_date.day, calendar.monthrange(year, month)[1])
+        return datetime.datetime(year=year, month=month, day=day)
+
+    def check_expiration(self, expiration_date, retention_months):
+        """
+        Checks expiration date against today's date and returns true or false based on retention months
+        :param expiration_date: Date something expires
+        :param retention_months: Number of months past today the expiration is still good
+        :return: True - within retention | False - out of retention
+        """
+        # add retention months to expiration date
+        true_expiration = self.get_retention_end(expiration_date=expiration_date, retention_months=retention_months)
+
+        # compare true expiration to today
+        if (true_expiration - datetime.datetime.today()).days > 0:
+            return True
+        else:
+            return False
@@ -0,0 +1,857 @@
+
+import os
+import json
+import datetime
+from time import time
+from time import sleep
+
+from SimpleLdapLib import SimpleLdap
+from .User import User
+from .Tools import Tools
+from .ThreadedUserProcess import ThreadedUserProcess, ThreadedSubtreeProcess
+from .SubtreeQueue import SubtreeQueue
+from .IoThrottle import IoThrottle
+from .TreeDeleter import TreeDeleter
+from .TreeWalker import TreeWalker
+from .ScheduleIndex import ScheduleIndex
+from .RetentionPolicy import RetentionPolicy
+from .ArchiveBackend import get_archive_backend, get_archive_backend_for_file, get_archive_extensions
+
+
+class RetentionRunError(Exception):
+    pass
+
+
+class RetentionRun(object):
+
+    def __init__(self, config, ldap_config, ldap=None, policy=None, size_index=None):
+        """
+        A single pass of the retention enforcer. Everything that used to be worked out once per process, such as the
+        archive time stamp, belongs to the run, so a long running process can start as many runs as it needs.
+        :param config: the config dictionary
+        :param ldap_config: the ldap config dictionary
+        :param ldap: an already bound SimpleLdap object to use, None to bind a new one for the run
+        :param policy: a RetentionPolicy object, None to make one from the config
+        :param size_index: dictionary of user ID to (modify date, folder size) that is filled in as users are sized
+        """
+        self.config = config
+        self.ldap_config = ldap_config
+        self.ldap = ldap
+        self.policy = policy if policy is not None else RetentionPolicy(config=config)
+        self.size_index = size_index
+        self.time_stamp = '{0}_{1}'.format(str(datetime.datetime.today().date()).replace('-', '_'),
+                                           datetime.datetime.today().strftime('%H_%M'))
+        self.archive_path = '{0}/{1}'.format(config['archive_path'], self.time_stamp)
+        self.users = []
+        self.users_to_archive = []
+        self.throttle = IoThrottle(read_limit=config['io_read_limit'], write_limit=config['io_write_limit'],
+                                   metadata_limit=config['io_metadata_limit'], schedule=config['io_limit_schedule'])
+
+    def run(self, interactive=True):
+        """
+        Look up every user, archive the ones that are out of retention and remove old archives
+        :param interactive: allow asking for confirmation before archiving, when False archiving is skipped instead
+        :return: None
+        """
+        start_time = time()
+
+        # find the users to look at
+        uids, schedule_index, dir_mtimes = self.scan_uids()
+
+        # lookup all user information
+        users = self.lookup_user_ldap_info(uids=uids)
+
+        # process user information and determine user status
+        users_to_archive = self.process_users(users=users)
+
+        # remember when each kept user needs to be looked at again
+        if schedule_index:
+            self.update_schedule_index(users=users, schedule_index=schedule_index, dir_mtimes=dir_mtimes)
+
+        self.finish_run(users=users, users_to_archive=users_to_archive, interactive=interactive, start_time=start_time)
+
+    def scan_uids(self):
+        """
+        List the user IDs in the student data path, leaving out ignored names, users the schedule index says can be
+        skipped and anything past the user limit
+        :return: (a list of user IDs, a ScheduleIndex object or None, dictionary of user ID to directory mtime)
+        """
+        print('Scanning student data directory...')
+        try:
+            uids = os.listdir(self.config['student_data_path'])
+        except FileNotFoundError:
+            raise RetentionRunError("Data path does not exist: {0}".format(self.config['student_data_path']))
+
+        # filter user ids
+        for uid in uids:
+            if uid in self.config['file_ignore_filter'].split(','):
+                uids.remove(uid)
+        uids.sort()
+
+        # only look at users whose retention could have lapsed or whose data changed since the last run
+        schedule_index = None
+        dir_mtimes = {}
+        if self.config['schedule_index_path']:
+            schedule_index = ScheduleIndex(file_path=self.config['schedule_index_path'])
+            schedule_index.load()
+            uids, dir_mtimes = self.select_scheduled_uids(uids=uids, schedule_index=schedule_index)
+
+        # apply user limit
+        if self.config['user_limit']:
+            print('Limiting information compilation to {0} users. Edit the config to change this.'
+                  .format(self.config['user_limit']))
+            real_uids = []
+            i = 0
+            for uid in uids:
+                i += 1
+                real_uids.append(uid)
+                if i == self.config['user_limit']:
+                    break
+            uids = real_uids
+
+        return uids, schedule_index, dir_mtimes
+
+    def finish_run(self, users, users_to_archive, interactive=True, start_time=None):
+        """
+        Report on the processed users, archive the ones that are out of retention and remove old archives
+        :param users: a list of User objects that were looked up
+        :param users_to_archive: the Users out of those that are out of retention, with their folder sizes
+        :param interactive: allow asking for confirmation before archiving, when False archiving is skipped instead
+        :param start_time: when the run started, for the runtime stats
+        :return: None
+        """
+        if start_time is None:
+            start_time = time()
+        number_to_archive = len(users_to_archive)
+        self.users = users
+        self.users_to_archive = users_to_archive
+
+        # calculate archive file size
+        archive_file_size = 0
+        for user in users_to_archive:
+            archive_file_size += user.folder_size
+        archive_file_size = round(archive_file_size, 3)
+
+        # print all user information
+        if self.config['print_user_info'] and self.config['verbose_username']:
+            Tools().pretty_print_objects(objects=users, title='Users', objFilter='folder_path,folder_size')
+
+        # write a report of all user information
+        if self.config['user_report_format']:
+            self.write_user_report(users=users, output_format=self.config['user_report_format'])
+
+        # archive users if there are any to archive
+        if users_to_archive:
+            if self.config['print_user_info']:
+                Tools().pretty_print_objects(objects=users_to_archive, title='Users to Archive',
+                                             objFilter='folder_path')
+
+            print("File size of archive before compression: {0} MB".format(archive_file_size))
+            print("Number of users to be archived: {0}".format(number_to_archive))
+            if not self.config['disable_archiving']:
+
+                if self.config['confirm_before_archive']:
+                    if not interactive:
+                        print('Confirmation before archiving is enabled in the config, skipping archive step...')
+                        return
+                    user_input = input('About to archive {0} users. Continue? [yes|no]: '.format(number_to_archive))
+                    if user_input != 'yes':
+                        print('We will meet again. Exiting...')
+                        return
+
+                # self.archive_users(users=users_to_archive, archive_size=archive_file_size)
+                # archive the data in chunks to keep zip files from getting to big.
+                users_to_archive_in_chunks, archive_size_chunks = \
+                    self.divide_users_on_directory_size(users=users_to_archive)
+                for users in users_to_archive_in_chunks:
+                    archive_index = users_to_archive_in_chunks.index(users)
+                    print("Archive Index: {0}".format(archive_index))
+                    self.archive_users(users=users, archive_size=archive_size_chunks[archive_index],
+                                       archive_index=archive_index)
+
+            else:
+                print("Archiving is disabled in the config, skipping archive step...")
+        else:
+            print('No users found that could be archived.')
+
+        # remove previous archives
+        self.remove_old_archive()
+
+        # calc total runtime
+        if self.config['runtime_stats']:
+            self.print_io_stats()
+            run_time_seconds = (time() - start_time)
+            run_time_minuets = int(run_time_seconds / 60)
+            if run_time_minuets == 0:
+                run_time = int(run_time_seconds)
+                units = 'seconds'
+            else:
+                run_time = run_time_minuets
+                units = 'minuets'
+            print("Total runtime: {0} {1}".format(run_time, units))
+
+        print('Done.')
+
+    def print_io_stats(self):
+        """
+        Print how much was read, written and done to file system metadata over the run, the average rates and how
+        long the I/O limits held threads back
+        :return: None
+        """
+        stats = self.throttle.get_stats()
+        for kind, action in (('read', 'Read'), ('write', 'Wrote')):
+            total, rate, wait_time = stats[kind]
+            print("{0} {1} MB at {2} MB/s, waited {3} seconds for the {4} limit".format(
+                action, round(total / 1000000, 3), round(rate / 1000000, 3), round(wait_time, 1), kind))
+        total, rate, wait_time = stats['metadata']
+        print("Did {0} metadata operations at {1} per second, waited {2} seconds for the metadata limit".format(
+            total, round(rate, 1), round(wait_time, 1)))
+
+    def prepare_shards(self, shard_queue, shard_count, method='hash'):
+        """
+        Coordinator step that splits the users to look at into shards for worker processes
+        :param shard_queue: a ShardQueue object
+        :param shard_count: number of shards
+        :param method: hash | range
+        :return: None
+        """
+        uids, schedule_index, dir_mtimes = self.scan_uids()
+        try:
+            shard_queue.prepare(uids=uids, shard_count=shard_count, method=method, dir_mtimes=dir_mtimes)
+        except (FileExistsError, ValueError) as e:
+            raise RetentionRunError(e)
+        print('Split {0} users into {1} shards in {2}'.format(len(uids), len(shard_queue.get_shard_names()),
+                                                              shard_queue.queue_path))
+
+    def work_shards(self, shard_queue):
+        """
+        Worker step that looks up, sizes and evaluates the users of each shard it can claim, until none are left
+        :param shard_queue: a ShardQueue object
+        :return: number of shards worked on
+        """
+        shards_done = 0
+        while True:
+            shard = shard_queue.claim()
+            if shard is None:
+                break
+            print('Working on {0}'.format(shard))
+            heartbeat = shard_queue.start_heartbeat(shard=shard)
+            try:
+                users = self.lookup_user_ldap_info(uids=shard_queue.read_shard(shard=shard))
+                self.process_users(users=users)
+                shard_queue.complete(shard=shard, users=users)
+            finally:
+                heartbeat.set()
+            shards_done += 1
+        print('No shards left to claim, finished {0} shards'.format(shards_done))
+        if self.config['runtime_stats']:
+            self.print_io_stats()
+        return shards_done
+
+    def merge_shards(self, shard_queue, interactive=True, wait=False):
+        """
+        Coordinator step that merges the shard results into a single set of users and finishes the run with them,
+        so there is one plan, one archive layout and one set of manifests. The queue is removed once the run is done.
+        :param shard_queue: a ShardQueue object
+        :param interactive: allow asking for confirmation before archiving
+        :param wait: wait for unfinished shards instead of stopping
+        :return: None
+        """
+        start_time = time()
+        unfinished = shard_queue.get_unfinished_shards()
+        if unfinished and not wait:
+            raise RetentionRunError("{0} shards are not finished yet: {1}".format(len(unfinished),
+                                                                                  ', '.join(unfinished)))
+        shard_queue.wait()
+
+        users = shard_queue.read_results()
+        users_to_archive = [user for user in users if not user.user_status]
+        print('Merged {0} users from {1} shards'.format(len(users), len(shard_queue.get_shard_names())))
+
+        if self.config['schedule_index_path']:
+            dir_mtimes = shard_queue.read_queue()['dir_mtimes']
+            schedule_index = ScheduleIndex(file_path=self.config['schedule_index_path'])
+            schedule_index.load()
+            if dir_mtimes:
+                for uid in set(schedule_index.entries) - set(dir_mtimes):
+                    schedule_index.remove(uid=uid)
+            self.update_schedule_index(users=users, schedule_index=schedule_index, dir_mtimes=dir_mtimes)
+
+        self.finish_run(users=users, users_to_archive=users_to_archive, interactive=interactive, start_time=start_time)
+        shard_queue.remove()
+
+    def lookup_user_ldap_info(self, uids):
+        """
+        Look up user information from ldap
+        :param uids: a list of user IDs
+        :return: a list of User objects
+        """
+        print('Compiling information on users...')
+        ldap_d = self.ldap
+        if ldap_d is None:
+            ldap_d = SimpleLdap()
+            ldap_d.config = self.ldap_config
+            if not ldap_d.bind_server():
+                raise RetentionRunError("Failed to bind to ldap server.")
+
+        ldap_users = []
+        runtime_sum = 0
+        users_processed = 0
+        for uid in uids:
+
+            start_time = time()
+
+            if self.config['verbose_username']:
+                print('Compiling information on user: {0}'.format(uid))
+            ldap_users.append(self.lookup_user(ldap_d=ldap_d, uid=uid))
+
+            # show runtime stats
+            if self.config['runtime_stats']:
+                run_time = time() - start_time
+                users_processed += 1
+                runtime_sum += run_time
+
+                # only show stats every so many users
+                if users_processed % self.config['runtime_stats'] == 0:
+                    # calc average
+                    average_runtime = runtime_sum / users_processed
+
+                    # calc time left
+                    users_remaining = len(uids) - users_processed
+                    seconds_left = users_remaining * average_runtime
+                    minuets_left = int(seconds_left / 60)
+                    units = 'minuets'
+                    time_left = minuets_left
+                    if minuets_left == 0:
+                        time_left = int(seconds_left)
+                        units = 'seconds'
+
+                    print('Average runtime for information compilation: {0:03d} milliseconds, '
+                          'Estimated time left: {1:02d} {2}, Users remaining: {3:05d}'.
+                          format(int(average_runtime * 1000), time_left, units, users_remaining), end='\r')
+        if self.config['runtime_stats']:
+            print()
+
+        # a connection that was handed to the run is left bound for the next one
+        if self.ldap is None:
+            ldap_d.unbind_server()
+        print('Total number of users processed: {0}'.format(len(uids)))
+        return ldap_users
+
+    def lookup_user(self, ldap_d, uid):
+        """
+        Look up a single user's information from ldap
+        :param ldap_d: a bound SimpleLdap object
+        :param uid: user ID
+        :return: a User object
+        """
+        ldap_user = ldap_d.search(search_filter="(uid={0})".format(uid))
+        folder_path = '{0}{1}{2}'.format(self.config['student_data_path'], '/', uid)
+
+        if not ldap_user:
+            return User(uid=uid,
+                        full_name="User not in ldap",
+                        wmu_enrolled=None,
+                        inet_user_status='deleted',
+                        wmu_student_expiration=None,
+                        wmu_employee_expiration=None,
+                        modify_date=datetime.datetime.fromtimestamp(os.stat(folder_path).st_mtime),
+                        folder_size=None,
+                        folder_path=folder_path)
+        return User(uid=uid,
+                    full_name=ldap_user['displayName'],
+                    wmu_enrolled=ldap_user['wmuEnrolled'],
+                    inet_user_status=ldap_user['inetUserStatus'],
+                    wmu_student_expiration=ldap_user['wmuStudentExpiration'],
+                    wmu_employee_expiration=ldap_user['wmuEmployeeExpiration'],
+                    modify_date=datetime.datetime.fromtimestamp(os.stat(folder_path).st_mtime),
+                    folder_size=None,
+                    folder_path=folder_path)
+
+    def process_users(self, users):
+        """
+        Process the user's information. Mainly calculate disk space used. Uses thread pooling so runtime stats are not
+        always very accurate at calculating estimated time left. Walks of large user folders are split into subtrees
+        that idle threads help with, so the last few users do not hold up the run.
+        :param users: A list of Users
+        :return: A list of Users
+        """
+        users_to_archive = []
+        threads = []
+        done_threads = []
+        thread_pool = []
+        runtime_sum = 0
+        users_processed = 0
+        subtree_queue = SubtreeQueue(walker=self.get_walker(), split_files=self.config['split_files'],
+                                     split_seconds=self.config['split_seconds'])
+
+        print('Processing user information...')
+
+        # prepare threads
+        for user in users:
+            user.user_status = self.policy.determine_user_status(user=user)
+            if not user.user_status:
+                users_to_archive.append(user)
+                threads.append(ThreadedUserProcess(user=user, subtree_queue=subtree_queue,
+                                                  verbose_username=self.config['verbose_username']))
+
+        # determine number of threads to use
+        process_threads = self.config['process_threads']
+        if len(threads) < process_threads:
+            process_threads = len(threads)
+
+        # fill thread pool
+        for i in range(process_threads):
+            thread_pool.append(threads.pop())
+
+        # start all threads in pool
+        for thread in thread_pool:
+            thread.start()
+
+        # manage the thread pool
+        while threads:
+            sleep(0.2)
+            for thread in thread_pool:
+                if not thread.is_alive():
+
+                    # show runtime stats
+                    if self.config['runtime_stats']:
+                        runtime_sum += thread.runtime
+                        users_processed += 1
+                        if users_processed % self.config['runtime_stats'] == 0:
+                            # calc average
+                            average_runtime = runtime_sum / users_processed
+
+                            # calc time left
+                            users_remaining = len(users_to_archive) - users_processed
+                            seconds_left = users_remaining * average_runtime
+                            minuets_left = int(seconds_left / 60)
+                            units = 'minuets'
+                            time_left = minuets_left
+                            if minuets_left == 0:
+                                time_left = int(seconds_left)
+                                units = 'seconds'
+
+                            print('Average runtime for user processing: {0:03d} milliseconds,'
+                                  ' Estimated time left: {1:02d} {2}, Users remaining: {3:05d}'.
+                                  format(int(average_runtime * 1000), time_left, units, users_remaining), end='\r')
+
+                    # shift threads in and out of thread pool
+                    done_threads.append(thread)
+                    thread_pool.remove(thread)
+                    try:
+                        new_thread = threads[0]
+                        thread_pool.append(new_thread)
+                        threads.pop(0)
+                        new_thread.start()
+                    except IndexError:
+                        pass
+
+        # wait for the last threads to finish
+        last_threads_running = True
+        while last_threads_running:
+            sleep(0.2)
+            last_threads_running = False
+
+            # put threads that are no longer needed for users to work on subtrees of the large folders
+            threads_running = len([thread for thread in thread_pool if thread.is_alive()])
+            while threads_running < process_threads and subtree_queue.has_tasks():
+                helper_thread = ThreadedSubtreeProcess(subtree_queue=subtree_queue)
+                helper_thread.start()
+                thread_pool.append(helper_thread)
+                threads_running += 1
+
+            for thread in thread_pool:
+                if thread.is_alive():
+                    last_threads_running = True
+                else:
+                    # show runtime stats
+                    if self.config['runtime_stats']:
+                        if thread.runtime != 0:
+                            runtime_sum += thread.runtime
+                            users_processed += 1
+                            thread.runtime = 0
+                            if users_processed % self.config['runtime_stats'] == 0:
+                                # calc average
+                                average_runtime = runtime_sum / users_processed
+
+                                # calc time left
+                                users_remaining = len(users_to_archive) - users_processed
+                                seconds_left = users_remaining * average_runtime
+                                minuets_left = int(seconds_left / 60)
+                                units = 'minuets'
+                                time_left = minuets_left
+                                if minuets_left == 0:
+                                    time_left = int(seconds_left)
+                                    units = 'seconds'
+
+                                print('Average runtime for user processing: {0:03d} milliseconds,'
+                                      ' Estimated time left: {1:02d} {2}, Users remaining: {3:05d}'.
+                                      format(int(average_runtime * 1000), time_left, units, users_remaining), end='\r')
+        if self.config['runtime_stats']:
+            print()
+            if subtree_queue.published:
+                print("Split {0} subtrees off of large user folders".format(subtree_queue.published))
+
+        # join all threads
+        for thread in done_threads:
+            thread.join()
+
+        # keep the sizes for anything that wants them without walking the folders again
+        if self.size_index is not None:
+            for user in users_to_archive:
+                self.size_index[user.uid] = (user.modify_date, user.folder_size)
+
+        return users_to_archive
+
+    def select_scheduled_uids(self, uids, schedule_index):
+        """
+        Filter user IDs down to the ones that are due in the schedule index, new to it, or whose data directory changed
+        :param uids: a list of user IDs found in the student data path
+        :param schedule_index: a loaded ScheduleIndex object
+        :return: (a list of user IDs to look up, dictionary of user ID to data directory modification time)
+        """
+        due_uids = schedule_index.pop_due(now=time())
+        scheduled_uids = []
+        dir_mtimes = {}
+        changed = 0
+        for uid in uids:
+            try:
+                dir_mtime = os.stat('{0}/{1}'.format(self.config['student_data_path'], uid)).st_mtime
+            except (FileNotFoundError, OSError):
+                continue
+            if uid in due_uids:
+                scheduled_uids.append(uid)
+            elif schedule_index.is_changed(uid=uid, dir_mtime=dir_mtime):
+                changed += 1
+                scheduled_uids.append(uid)
+            dir_mtimes[uid] = dir_mtime
+
+        # forget users whose data directory is gone
+        for uid in set(schedule_index.entries) - set(dir_mtimes):
+            schedule_index.remove(uid=uid)
+
+        print('Schedule index: {0} users due, {1} users new or changed, {2} users skipped'.format(
+            len(scheduled_uids) - changed, changed, len(uids) - len(scheduled_uids)))
+        return scheduled_uids, dir_mtimes
+
+    def update_schedule_index(self, users, schedule_index, dir_mtimes):
+        """
+        Store the next check date of every kept user in the schedule index and save it. Users without a known archive
+        date, and users whose date is far away, are checked again after schedule_recheck_days so ldap changes are seen.
+        :param users: a list of User objects that were looked up this run
+        :param schedule_index: a loaded ScheduleIndex object
+        :param dir_mtimes: dictionary of user ID to data directory modification time
+        :return: None
+        """
+        recheck_date = datetime.datetime.today() + datetime.timedelta(days=self.config['schedule_recheck_days'])
+        for user in users:
+            if not user.user_status:
+                # users to archive are looked at again next run until their data is gone
+                schedule_index.remove(uid=user.uid)
+                continue
+            due_date = self.policy.determine_user_archive_date(user=user)
+            if due_date is None or due_date > recheck_date:
+                due_date = recheck_date
+            schedule_index.schedule(uid=user.uid, due=due_date.timestamp(), dir_mtime=dir_mtimes.get(user.uid))
+        schedule_index.save()
+
+    def divide_users_on_directory_size(self, users):
+        users_to_archive = []
+        user_chunk = []
+        archive_size_chunks = []
+        archive_size = 0
+        for user in users:
+            archive_size += user.folder_size
+            user_chunk.append(user)
+            if archive_size >= self.config['max_archive_size']:
+                users_to_archive.append(user_chunk)
+                archive_size_chunks.append(archive_size)
+                user_chunk = []
+                archive_size = 0
+        if user_chunk:
+            users_to_archive.append(user_chunk)
+            archive_size_chunks.append(archive_size)
+        return users_to_archive, archive_size_chunks
+
+    def archive_users(self, users, archive_size, archive_index=0):
+        """
+        Archive user data into a single archive file using the backend set by archive_format in the config. The user
+        folders are streamed straight into the archive and checksummed on the way, then the archive is read back and
+        each user's folder is only removed once all of their files have been verified.
+        :param users: a list of User objects
+        :param archive_size: the size of the archive
+        :param archive_index: the index of the archive if there is more than one
+        :return: None
+        """
+        print('Archiving user data...')
+        backend = get_archive_backend(name=self.config['archive_format'])
+        backend.walker = self.get_walker(follow_symlinks=backend.follow_symlinks)
+        backend.throttle = self.throttle
+        backend.configure(config=self.config)
+        archive_name = '{0}_{1}'.format(self.time_stamp, archive_index)
+        archive_file = backend.archive_file_name(base_name='{0}_{1}'.format(self.archive_path, archive_index))
+        if os.path.exists(archive_file):
+            print('{0} already exists. Skipping user data archive...'.format(archive_file))
+            return
+
+        # compress archive
+        print('Compressing archive...')
+        members = [(user.folder_path, '{0}/{1}'.format(archive_name, user.uid)) for user in users]
+        try:
+            checksums = backend.write(archive_file=archive_file, members=members, sha256=self.config['verify_sha256'])
+        except (UnicodeEncodeError, ValueError, OSError) as e:
+            print("Compressing archive failed: {0} User data was left in place. {1}".format(e, archive_name))
+            try:
+                os.remove(archive_file)
+            except FileNotFoundError:
+                pass
+            return
+
+        # anything left out of the archive keeps its user's data in place, whether or not the archive is verified
+        verified_users = [user for user in users if not backend.skipped.get('{0}/{1}'.format(archive_name, user.uid))]
+        if len(verified_users) != len(users) and not self.config['verify_archive']:
+            print("{0} users had files that could not be archived, their data was left in place.".format(
+                len(users) - len(verified_users)))
+
+        # read the archive back and check it against the checksums taken while it was written
+        run_stats = {'date': self.time_stamp, 'users_archived': len(users),
+                     'archive_size': '{0} MB'.format(archive_size),
+                     'archive_format': backend.name,
+                     'archive_file': os.path.basename(archive_file)}
+        if backend.compression_stats:
+            stats = backend.compression_stats
+            run_stats['stored_size'] = '{0} MB'.format(round(stats.stored_bytes / 1048576, 3))
+            run_stats['compressed_size'] = '{0} MB to {1} MB'.format(round(stats.compressed_bytes / 1048576, 3),
+                                                                    round(stats.compressed_size / 1048576, 3))
+            if self.config['runtime_stats']:
+                print("Stored {0} files ({1}) without compression and compressed {2} files ({3}), saving about "
+                      "{4} CPU seconds".format(stats.stored_files, run_stats['stored_size'], stats.compressed_files,
+                                               run_stats['compressed_size'], round(stats.get_time_saved(), 1)))
+        if self.config['verify_archive']:
+            print('Verifying archive...')
+            result = backend.verify(archive_file=archive_file, checksums=checksums,
+                                    threads=self.config['verify_threads'], skipped=backend.skipped)
+            verified_users = [user for user in users if result.passed(arcname='{0}/{1}'.format(archive_name, user.uid))]
+            verify_size = round(result.bytes / 1000000, 3)
+            verify_rate = round(verify_size / result.runtime, 3) if result.runtime else verify_size
+            run_stats['users_verified'] = len(verified_users)
+            run_stats['verify_throughput'] = '{0} MB/s'.format(verify_rate)
+            if self.config['runtime_stats']:
+                print("Verified {0} files ({1} MB) in {2} seconds: {3} MB/s".format(
+                    result.members, verify_size, round(result.runtime, 3), verify_rate))
+            for arcname, errors in sorted(result.errors.items()):
+                for name, error in errors:
+                    print("Verification failed for {0}: {1}".format(name, error))
+            if len(verified_users) != len(users):
+                print("{0} users failed verification, their data was left in place.".format(
+                    len(users) - len(verified_users)))
+
+        # the checksums of every file can be far larger than the manifest, so they go in a json lines file of their own
+        checksums_name = '{0}_checksums.jsonl'.format(archive_name)
+        checksums_path = '{0}/{1}'.format(self.config['archive_path'], checksums_name)
+        print("Writing checksums: {0}".format(checksums_path))
+        try:
+            with open(checksums_path, 'w') as checksums_file:
+                for user in users:
+                    checksums_file.write(json.dumps({'uid': user.uid, 'checksums': checksums.get(
+                        '{0}/{1}'.format(archive_name, user.uid), {})}, sort_keys=True) + '\n')
+            run_stats['archive_checksums_file'] = checksums_name
+        except OSError as e:
+            print("{0} Failed to write file path: {1}".format(e, checksums_path))
+
+        # write manifest file
+        print("Writing manifest...")
+        verified_uids = set(user.uid for user in verified_users)
+        manifest = {'0_run_stats': run_stats}
+        for user in users:
+            # copy the user's variables so the dates on the User object are left alone
+            manifest[user.uid] = dict(user.__dict__)
+            if isinstance(user.wmu_student_expiration, datetime.datetime):
+                manifest[user.uid]['wmu_student_expiration'] = str(user.wmu_student_expiration.strftime('%D'))
+            if isinstance(user.wmu_employee_expiration, datetime.datetime):
+                manifest[user.uid]['wmu_employee_expiration'] = str(user.wmu_employee_expiration.strftime('%D'))
+            if isinstance(user.modify_date, datetime.datetime):
+                manifest[user.uid]['modify_date'] = str(user.modify_date.strftime('%D'))
+            if self.config['verify_archive']:
+                manifest[user.uid]['archive_verified'] = user.uid in verified_uids
+        Tools.write_json_file(file_path='{0}/{1}'.format(self.config['archive_path'],
+                                                         '{0}_manifest.json'.format(archive_name)),
+                              json_data=manifest)
+
+        # remove archived user data, only for the users whose data was read back from the archive intact
+        if verified_users:
+            self.remove_user_data(users=verified_users)
+
+    def remove_user_data(self, users):
+        """
+        Remove the data folders of users with the parallel tree deleter
+        :param users: a list of User objects
+        :return: None
+        """
+        deleter = TreeDeleter(threads=self.config['delete_threads'], dry_run=self.config['delete_dry_run'],
+                              progress=self.config['runtime_stats'], walker=self.get_walker(stat_entries=False),
+                              throttle=self.throttle)
+        if self.config['delete_dry_run']:
+            print('Deletion dry run is enabled in the config, user data will not be removed...')
+        total_files = 0
+        total_dirs = 0
+        total_errors = 0
+        start_time = time()
+        for user in users:
+            if self.config['verbose_username']:
+                print("Removing user data: {0}".format(user.uid))
+            result = deleter.delete(path=user.folder_path)
+            total_files += result.files
+            total_dirs += result.dirs
+            total_errors += len(result.errors)
+            if self.config['verbose_username']:
+                print("Removed {0} files and {1} directories for user {2} in {3} seconds".format(
+                    result.files, result.dirs, user.uid, int(result.runtime)))
+            for path, error in result.errors:
+                print("Failed to remove {0} for user {1}: {2}".format(path, user.uid, error))
+        print("Removed {0} files and {1} directories with {2} errors in {3} seconds".format(
+            total_files, total_dirs, total_errors, int(time() - start_time)))
+
+    def get_walker(self, follow_symlinks=True, stat_entries=True):
+        """
+        Build a TreeWalker with the prefetch settings from the config
+        :param follow_symlinks: follow symlinks when stating entries
+        :param stat_entries: stat every entry while reading a directory
+        :return: a TreeWalker object
+        """
+        return TreeWalker(prefetch_threads=self.config['walk_prefetch_threads'],
+                          prefetch_dirs=self.config['walk_prefetch_dirs'],
+                          stat_entries=stat_entries, follow_symlinks=follow_symlinks, throttle=self.throttle)
+
+    def remove_old_archive(self):
+        """
+        Searches archive directory for old archives and deletes them if they are out of retention
+        :return: None
+        """
+        try:
+            archive_extensions = tuple(get_archive_extensions())
+            for archive in os.listdir(self.config['archive_path']):
+                # only archive files are removed, manifest files are kept
+                if not archive.endswith(archive_extensions):
+                    continue
+                archive_date_info = archive.split('_')
+                try:
+                    year = int(archive_date_info[0])
+                    month = int(archive_date_info[1])
+                    day = int(archive_date_info[2])
+                except (ValueError, IndexError):
+                    continue
+                archive_date = datetime.datetime(year=year, month=month, day=day)
+                if not self.policy.check_expiration(expiration_date=archive_date,
+                                                    retention_months=self.config['data_retention_months_of_archive']):
+                    delete_archive_path = '{0}/{1}'.format(self.config['archive_path'], archive)
+                    print('Removing old archive: {0}'.format(delete_archive_path))
+                    os.remove(path=delete_archive_path)
+        except FileNotFoundError as e:
+            print("{0} Skipping removal of old archive...".format(e))
+
+    def write_user_report(self, users, output_format):
+        """
+        Write information about all users to a report file in the archive path
+        :param users: a list of User objects
+        :param output_format: csv | jsonl
+        :return: None
+        """
+        file_path = '{0}/{1}_users.{2}'.format(self.config['archive_path'], self.time_stamp, output_format)
+        print("Writing user report: {0}".format(file_path))
+        try:
+            with open(file_path, 'w', newline='') as report_file:
+                Tools().pretty_print_objects(objects=users, output_format=output_format, stream=report_file)
+        except (FileNotFoundError, PermissionError, OSError) as e:
+            print("{0} Failed to write file path: {1}".format(e, file_path))
+
+    def restore_user(self, uid, target_path, list_only=False, archive_file=None):
+        """
+        Restore a single user's data from the newest archive that has it. Only the user's members are read, so for zip
+        archives the restore time depends on the size of the user's data and not on the size of the archive.
+        :param uid: User ID to restore
+        :param target_path: directory that the user folder will be restored into
+        :param list_only: only list the user's files instead of extracting them
+        :param archive_file: name of the archive to restore from, None to use the newest archive with the user in it
+        :return: None
+        """
+        user_archive = self.find_user_archive(uid=uid, archive_file=archive_file)
+        if not user_archive:
+            print("No archive found for user: {0}".format(uid))
+            return
+
+        archive_name, archive_date = user_archive
+        archive_file = '{0}/{1}'.format(self.config['archive_path'], archive_name)
+        backend = get_archive_backend_for_file(archive_file=archive_file)
+        prefix = '{0}/{1}'.format(archive_name[:-len(backend.extension)], uid)
+        print("Found user {0} in archive {1} from {2}".format(uid, archive_name, archive_date))
+
+        if list_only:
+            for name, size, mtime in backend.list_members(archive_file=archive_file, prefix=prefix):
+                print("{0:>12} {1} {2}".format(size, datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M'),
+                                               name))
+            return
+
+        user_target_path = os.path.join(target_path, uid)
+        if os.path.exists(user_target_path):
+            print("Restore path already exists: {0} Exiting...".format(user_target_path))
+            return
+        start_time = time()
+        print("Restoring user {0} to {1}".format(uid, user_target_path))
+        extracted = backend.extract_members(archive_file=archive_file, prefix=prefix, target_path=user_target_path,
+                                            threads=self.config['restore_threads'])
+        print("Restored {0} files and directories in {1} seconds".format(extracted, int(time() - start_time)))
+
+    def find_user_archive(self, uid, archive_file=None):
+        """
+        Search the manifests, newest first, for the archive that contains a user. Manifests can be very large, so each
+        one is only searched as text for the user and just its run stats are parsed.
+        :param uid: User ID to search for
+        :param archive_file: name of the archive to look for, None for the newest archive with the user in it
+        :return: (archive file name, archive date) of an archive that still exists, None if there is none
+        """
+        try:
+            manifests = sorted([f for f in os.listdir(self.config['archive_path']) if f.endswith('_manifest.json')],
+                               reverse=True)
+        except FileNotFoundError as e:
+            print("{0} Can not search for archives...".format(e))
+            return None
+
+        # manifests are written with an indent of 4, so users are the keys indented by exactly 4 spaces
+        user_key = '\n    {0}: {{'.format(json.dumps(uid))
+        for manifest_name in manifests:
+            manifest_path = '{0}/{1}'.format(self.config['archive_path'], manifest_name)
+            try:
+                with open(manifest_path, 'r') as manifest_file:
+                    manifest_text = manifest_file.read()
+            except OSError as e:
+                print("{0} Skipping manifest: {1}".format(e, manifest_path))
+                continue
+            if user_key not in manifest_text:
+                continue
+            run_stats = get_run_stats(manifest_text=manifest_text)
+            # manifests written before archive backends existed always point at a zip file
+            archive_name = run_stats.get('archive_file',
+                                         '{0}.zip'.format(manifest_name[:-len('_manifest.json')]))
+            if archive_file and archive_name != os.path.basename(archive_file):
+                continue
+            if os.path.isfile('{0}/{1}'.format(self.config['archive_path'], archive_name)):
+                return archive_name, run_stats.get('date')
+        return None
+
+
+def get_run_stats(manifest_text):
+    """
+    Parse only the 0_run_stats section of a manifest
+    :param manifest_text: the text of a manifest file
+    :return: dictionary, empty if the manifest has no run stats
+    """
+    start = manifest_text.find('"0_run_stats": ')
+    if start < 0:
+        return {}
+    try:
+        run_stats = json.JSONDecoder().raw_decode(manifest_text, start + len('"0_run_stats": '))[0]
+    except ValueError:
+        return {}
+    return run_stats if isinstance(run_stats, dict) else {}
@@ -0,0 +1,95 @@
+
+import os
+import json
+import heapq
+
+
+class ScheduleIndex(object):
+
+    def __init__(self, file_path):
+        """
+        Persistent priority index of the earliest date that each kept user's data could be archived. Users are only
+        looked at again once that date has passed or their data directory has changed, so daily runs scale with the
+        number of users that change instead of the number of users.
+        :param file_path: path to the json file that holds the index
+        """
+        self.file_path = file_path
+        self.entries = {}
+        self.heap = []
+
+    def load(self):
+        """
+        Load the index from disk. A missing or unreadable index is treated as empty, so every user gets looked at.
+        :return: None
+        """
+        self.entries = {}
+        try:
+            with open(self.file_path, 'r') as read_file:
+                index = json.load(read_file)
+            for due, uid, dir_mtime in index['entries']:
+                self.entries[uid] = (due, dir_mtime)
+        except FileNotFoundError:
+            pass
+        except (PermissionError, OSError, ValueError, KeyError, TypeError) as e:
+            print("{0} Failed to read schedule index: {1} Checking all users...".format(e, self.file_path))
+            self.entries = {}
+        # entries are saved sorted by due date, which is already a valid heap
+        self.heap = sorted((due, uid) for uid, (due, dir_mtime) in self.entries.items())
+
+    def save(self):
+        """
+        Write the index to disk, replacing the old one in a single step
+        :return: None
+        """
+        entries = sorted([due, uid, dir_mtime] for uid, (due, dir_mtime) in self.entries.items())
+        temp_path = '{0}.tmp'.format(self.file_path)
+        try:
+            with open(temp_path, 'w') as write_file:
+                json.dump({'version': 1, 'entries': entries}, write_file)
+            os.replace(temp_path, self.file_path)
+        except (PermissionError, OSError) as e:
+            print("{0} Failed to write schedule index: {1}".format(e, self.file_path))
+
+    def schedule(self, uid, due, dir_mtime):
+        """
+        Set the next time a user needs to be looked at
+        :param uid: User ID
+        :param due: timestamp after which the user must be checked again
+        :param dir_mtime: modification time of the user's data directory when it was checked
+        :return: None
+        """
+        self.entries[uid] = (due, dir_mtime)
+        heapq.heappush(self.heap, (due, uid))
+
+    def remove(self, uid):
+        """
+        Drop a user from the index
+        :param uid: User ID
+        :return: None
+        """
+        self.entries.pop(uid, None)
+
+    def pop_due(self, now):
+        """
+        Take every user whose due time has passed off the queue
+        :param now: current timestamp
+        :return: a set of User IDs
+        """
+        due_uids = set()
+        while self.heap and self.heap[0][0] <= now:
+            due, uid = heapq.heappop(self.heap)
+            # skip stale heap entries left behind by schedule() and remove()
+            if uid in self.entries and self.entries[uid][0] == due:
+                due_uids.add(uid)
+        return due_uids
+
+    def is_changed(self, uid, dir_mtime):
+        """
+        Check if a user is new to the index or their data directory changed since they were checked
+        :param uid: User ID
+        :param dir_mtime: current modification time of the user's data directory
+        :return: True | False
+        """
+        if uid not in self.entries:
+            return True
+        return self.entries[uid][1] != dir_mtime
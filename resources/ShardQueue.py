@@ -0,0 +1,274 @@
+
+import os
+import json
+import socket
+import datetime
+import threading
+import zlib
+from time import time
+from time import sleep
+
+from .User import User
+
+
+class ShardQueue(object):
+
+    def __init__(self, queue_path, lock_timeout=3600):
+        """
+        Work queue kept in a shared directory. The user IDs are split into shards, and any number of worker processes,
+        on one host or on several hosts that share the directory, claim shards with lock files and write back a
+        result file for each one. A claimed shard whose lock has not been touched for lock_timeout seconds is
+        assumed to belong to a dead worker and can be claimed again.
+        :param queue_path: directory that holds the queue
+        :param lock_timeout: seconds before an untouched lock is considered stale
+        """
+        self.queue_path = queue_path
+        self.lock_timeout = lock_timeout
+
+    def prepare(self, uids, shard_count, method='hash', dir_mtimes=None):
+        """
+        Split user IDs into shards and write them to the queue
+        :param uids: a sorted list of user IDs
+        :param shard_count: number of shards
+        :param method: hash - spread users by a hash of their ID | range - contiguous ranges of the sorted IDs
+        :param dir_mtimes: dictionary of user ID to data directory modification time from the schedule index
+        :return: None
+        """
+        os.makedirs(self.queue_path, exist_ok=True)
+        if os.path.exists(self.get_path('queue.json')):
+            raise FileExistsError("Queue already exists: {0}".format(self.queue_path))
+
+        shard_count = max(1, min(shard_count, len(uids)))
+        if method == 'hash':
+            shards = [[] for _ in range(shard_count)]
+            for uid in uids:
+                shards[zlib.crc32(uid.encode()) % shard_count].append(uid)
+        elif method == 'range':
+            shard_size = max(1, -(-len(uids) // shard_count))
+            shards = [uids[i:i + shard_size] for i in range(0, len(uids), shard_size)]
+        else:
+            raise ValueError("Unknown shard method: {0}".format(method))
+
+        for shard_index, shard_uids in enumerate(shards):
+            self.write_json(name=self.get_shard_name(shard_index), json_data={'uids': shard_uids})
+        # queue.json is written last, workers do not start until it exists
+        self.write_json(name='queue.json', json_data={'shards': len(shards), 'method': method,
+                                                      'dir_mtimes': dir_mtimes or {},
+                                                      'created': str(datetime.datetime.today())})
+
+    def read_queue(self):
+        """
+        Read the queue description, waiting for prepare() to finish if needed
+        :return: dictionary
+        """
+        while True:
+            try:
+                return self.read_json(name='queue.json')
+            except FileNotFoundError:
+                sleep(1)
+
+    def get_shard_names(self):
+        """
+        :return: a list of shard names
+        """
+        return [self.get_shard_name(shard_index) for shard_index in range(self.read_queue()['shards'])]
+
+    @staticmethod
+    def get_shard_name(shard_index):
+        return 'shard_{0:05d}'.format(shard_index)
+
+    def get_path(self, name):
+        return os.path.join(self.queue_path, name)
+
+    def read_shard(self, shard):
+        """
+        :param shard: shard name
+        :return: the list of user IDs in the shard
+        """
+        return self.read_json(name=shard)['uids']
+
+    def claim(self):
+        """
+        Claim the next shard that has no result and is not locked by a live worker
+        :return: shard name, or None if there is nothing left to claim
+        """
+        for shard in self.get_shard_names():
+            if os.path.exists(self.get_result_path(shard)):
+                continue
+            lock_path = '{0}.lock'.format(self.get_path(shard))
+            if self.try_lock(lock_path=lock_path):
+                # another worker may have finished the shard between the check and the lock
+                if os.path.exists(self.get_result_path(shard)):
+                    continue
+                return shard
+        return None
+
+    def try_lock(self, lock_path):
+        """
+        Create a lock file, taking it over if it is stale
+        :param lock_path: path of the lock file
+        :return: True if the lock is ours
+        """
+        owner = '{0} {1} {2}\n'.format(socket.gethostname(), os.getpid(), datetime.datetime.today())
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                with os.fdopen(fd, 'w') as lock_file:
+                    lock_file.write(owner)
+                return True
+            except FileExistsError:
+                pass
+            stale_path = '{0}.stale.{1}.{2}'.format(lock_path, socket.gethostname(), os.getpid())
+            try:
+                if time() - os.stat(lock_path).st_mtime < self.lock_timeout:
+                    return False
+                # rename is atomic, so only one worker gets to take over a stale lock
+                os.rename(lock_path, stale_path)
+                # another worker may have taken the stale lock over and made a new one between the stat and the
+                # rename, in which case the file that was moved is a live lock and has to be put back
+                if time() - os.stat(stale_path).st_mtime < self.lock_timeout:
+                    return self.restore_lock(lock_path=lock_path, stale_path=stale_path)
+                print("Taking over stale lock: {0}".format(lock_path))
+                os.unlink(stale_path)
+            except FileNotFoundError:
+                pass
+        return False
+
+    @staticmethod
+    def restore_lock(lock_path, stale_path):
+        """
+        Put back a live lock that was moved away by mistake. A hard link fails if the lock path exists, so a lock that
+        has been made in the meantime is never replaced.
+        :param lock_path: path of the lock file
+        :param stale_path: path the lock was moved to
+        :return: False, the lock is not ours
+        """
+        try:
+            os.link(stale_path, lock_path)
+            os.unlink(stale_path)
+        except OSError as e:
+            print("{0} Failed to restore lock: {1}".format(e, lock_path))
+        return False
+
+    def start_heartbeat(self, shard):
+        """
+        Keep touching a shard's lock file so other workers know it is still being worked on
+        :param shard: shard name
+        :return: a threading.Event to set once the shard is done
+        """
+        stop_event = threading.Event()
+        lock_path = '{0}.lock'.format(self.get_path(shard))
+
+        def heartbeat():
+            while not stop_event.wait(timeout=self.lock_timeout / 4):
+                try:
+                    os.utime(lock_path)
+                except OSError:
+                    pass
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        return stop_event
+
+    def get_result_path(self, shard):
+        return '{0}.result.json'.format(self.get_path(shard))
+
+    def complete(self, shard, users):
+        """
+        Write the result of a shard
+        :param shard: shard name
+        :param users: a list of processed User objects
+        :return: None
+        """
+        self.write_json(name='{0}.result.json'.format(shard),
+                        json_data={'host': socket.gethostname(), 'pid': os.getpid(),
+                                   'users': [user_to_json(user=user) for user in users]})
+
+    def get_unfinished_shards(self):
+        """
+        :return: a list of the shard names that have no result yet
+        """
+        return [shard for shard in self.get_shard_names() if not os.path.exists(self.get_result_path(shard))]
+
+    def wait(self, poll_seconds=5):
+        """
+        Block until every shard has a result
+        :param poll_seconds: seconds between checks
+        :return: None
+        """
+        while self.get_unfinished_shards():
+            sleep(poll_seconds)
+
+    def read_results(self):
+        """
+        Merge the results of all shards
+        :return: a list of User objects sorted by user ID
+        """
+        users = []
+        for shard in self.get_shard_names():
+            result = self.read_json(name='{0}.result.json'.format(shard))
+            users.extend(user_from_json(data=data) for data in result['users'])
+        users.sort(key=lambda user: user.uid)
+        return users
+
+    def remove(self):
+        """
+        Remove the queue files once the run has been merged, so the queue directory can be used by the next run
+        :return: None
+        """
+        # queue.json goes first so nothing starts working on the queue while it is being removed
+        names = ['queue.json'] + sorted(name for name in os.listdir(self.queue_path)
+                                        if name.startswith(('shard_', 'queue.json.')))
+        for name in names:
+            try:
+                os.unlink(self.get_path(name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("{0} Failed to remove queue file: {1}".format(e, self.get_path(name)))
+
+    def read_json(self, name):
+        with open(self.get_path(name), 'r') as read_file:
+            return json.load(read_file)
+
+    def write_json(self, name, json_data):
+        """
+        Write a json file into the queue so that readers never see it half written
+        :param name: file name inside the queue
+        :param json_data: dictionary to write
+        :return: None
+        """
+        path = self.get_path(name)
+        temp_path = '{0}.{1}.{2}.tmp'.format(path, socket.gethostname(), os.getpid())
+        with open(temp_path, 'w') as write_file:
+            json.dump(json_data, write_file)
+        os.replace(temp_path, path)
+
+
+user_date_fields = ('wmu_student_expiration', 'wmu_employee_expiration', 'modify_date')
+
+
+def user_to_json(user):
+    """
+    Convert a User object into a dictionary that can be written as json
+    :param user: a User object
+    :return: dictionary
+    """
+    data = dict(user.__dict__)
+    for field in user_date_fields:
+        if isinstance(data[field], datetime.datetime):
+            data[field] = data[field].timestamp()
+    return data
+
+
+def user_from_json(data):
+    """
+    Rebuild a User object written by user_to_json()
+    :param data: dictionary
+    :return: a User object
+    """
+    user = User.__new__(User)
+    user.__dict__.update(data)
+    for field in user_date_fields:
+        if data[field] is not None:
+            setattr(user, field, datetime.datetime.fromtimestamp(data[field]))
+    return user
@@ -0,0 +1,137 @@
+
+import os
+import threading
+from time import time
+from collections import deque
+
+from .TreeWalker import TreeWalker
+
+
+class FolderTotal(object):
+
+    def __init__(self):
+        """
+        Running size of a single user's folder, added to by every thread that works on a part of it
+        """
+        self.size = 0
+        self.tasks = 0
+        self.condition = threading.Condition()
+
+    def add(self, size):
+        with self.condition:
+            self.size += size
+
+    def task_added(self, count):
+        with self.condition:
+            self.tasks += count
+
+    def task_done(self):
+        with self.condition:
+            self.tasks -= 1
+            if not self.tasks:
+                self.condition.notify_all()
+
+    def wait(self):
+        """
+        Block until every subtree split off of the folder has been sized
+        :return: None
+        """
+        with self.condition:
+            while self.tasks:
+                self.condition.wait()
+
+
+class SubtreeQueue(object):
+
+    def __init__(self, walker=None, split_files=None, split_seconds=None):
+        """
+        Sizes user folders so that a single huge folder does not keep one thread busy long after the rest are done.
+        Once a walk has looked at split_files entries or run for split_seconds, the directories it has not visited
+        yet are put on a shared queue, and any thread that runs out of work takes them from there. Every part adds
+        its sizes to the folder's total, so the result is the same as walking the folder in one go.
+        :param walker: a TreeWalker to walk the folders with, None for the default one
+        :param split_files: number of entries a walk may look at before it is split, None to never split on it
+        :param split_seconds: seconds a walk may run before it is split, None to never split on it
+        """
+        self.walker = walker or TreeWalker()
+        self.split_files = split_files
+        self.split_seconds = split_seconds
+        self.tasks = deque()
+        self.tasks_lock = threading.Lock()
+        self.published = 0
+
+    def get_folder_size(self, folder_path):
+        """
+        Get the size of a folder in MB, helping with the queue while other threads finish its split off subtrees
+        :param folder_path: path to folder
+        :return: float
+        """
+        total = FolderTotal()
+        total.add(os.path.getsize(folder_path))
+        self.size_tree(total=total, path=folder_path)
+        self.work()
+        total.wait()
+        return total.size / 1048576
+
+    def size_tree(self, total, path):
+        """
+        Add the sizes of everything below a directory to a folder total, splitting the walk if it gets too long
+        :param total: the FolderTotal of the user's folder
+        :param path: directory to walk, its own size is not counted
+        :return: None
+        """
+        start_time = time()
+        entries = 0
+        size = 0
+
+        def split(pending_dirs):
+            if (self.split_files and entries >= self.split_files) or \
+                    (self.split_seconds and time() - start_time >= self.split_seconds):
+                self.publish(total=total, paths=list(pending_dirs))
+                return True
+            return False
+
+        for dir_path, dirs, files in self.walker.walk(path, split=split):
+            # the walker has already stated the entries in inode order, entry.stat() returns the cached result
+            for entry in files:
+                try:
+                    size += entry.stat().st_size
+                except (FileNotFoundError, OSError):
+                    pass
+            for entry in dirs:
+                try:
+                    size += entry.stat().st_size
+                except (FileNotFoundError, OSError):
+                    pass
+            entries += len(files) + len(dirs)
+        total.add(size)
+
+    def publish(self, total, paths):
+        """
+        Put unvisited directories of a folder on the queue
+        :param total: the FolderTotal of the user's folder
+        :param paths: a list of directory paths
+        :return: None
+        """
+        total.task_added(count=len(paths))
+        with self.tasks_lock:
+            self.tasks.extend((total, path) for path in paths)
+            self.published += len(paths)
+
+    def has_tasks(self):
+        return bool(self.tasks)
+
+    def work(self):
+        """
+        Size subtrees from the queue until it is empty
+        :return: None
+        """
+        while True:
+            with self.tasks_lock:
+                if not self.tasks:
+                    return
+                total, path = self.tasks.pop()
+            try:
+                self.size_tree(total=total, path=path)
+            finally:
+                total.task_done()
@@ -1,23 +1,46 @@
 
 import threading
-from .Tools import Tools
+from .SubtreeQueue import SubtreeQueue
 from time import time
-from resources.config import config
 
 
 class ThreadedUserProcess(threading.Thread):
 
-    def __init__(self, user):
+    def __init__(self, user, subtree_queue=None, walker=None, verbose_username=False):
+        """
+        Thread that sizes a single user's folder
+        :param user: the User object, its folder_size is set when the thread is done
+        :param subtree_queue: a SubtreeQueue to size the folder with, None for one that walks it in one go
+        :param walker: a TreeWalker to walk the folder with when there is no subtree_queue, None for the default one
+        :param verbose_username: print the user ID when the thread starts
+        """
         threading.Thread.__init__(self)
         self.user = user
+        self.subtree_queue = subtree_queue or SubtreeQueue(walker=walker)
+        self.verbose_username = verbose_username
         self.runtime = 0
 
     def run(self):
         start_time = time()
-        if config['verbose_username']:
+        if self.verbose_username:
             print("Processing user: {0}".format(self.user.uid))
-        self.user.folder_size = Tools().get_folder_size(folder_path=self.user.folder_path)
+        self.user.folder_size = self.subtree_queue.get_folder_size(folder_path=self.user.folder_path)
         self.runtime = time() - start_time
 
     def join(self):
         return self.user
+
+
+class ThreadedSubtreeProcess(threading.Thread):
+
+    def __init__(self, subtree_queue):
+        """
+        Helper thread that sizes subtrees split off of large user folders until there are none left
+        :param subtree_queue: the SubtreeQueue to take work from
+        """
+        threading.Thread.__init__(self)
+        self.subtree_queue = subtree_queue
+        self.runtime = 0
+
+    def run(self):
+        self.subtree_queue.work()
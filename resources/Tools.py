@@ -6,11 +6,28 @@ Description: Some old garbage code I wrote, but it prints object data in a neat
 """
 # import commands,re
 import os
+import sys
+import csv
+import json
+
+from .SubtreeQueue import SubtreeQueue
 
 
 class Tools(object):
 
-    def pretty_print_objects(self, objects, title=None, dividers=False, objFilter=None):
+    def pretty_print_objects(self, objects, title=None, dividers=False, objFilter=None, output_format='table',
+                             stream=None):
+        """
+        Print the variables of a list of objects as a table, or as csv or json lines for large reports. Column widths
+        are found in a single pass and the output is written to the stream in large blocks.
+        :param objects: a list of objects, or a single object
+        :param title: title printed above the table
+        :param dividers: print a line between each row of the table
+        :param objFilter: comma delimited list of variable names to leave out
+        :param output_format: table | csv | jsonl
+        :param stream: file object to write to, defaults to stdout
+        :return: None
+        """
         horizontalLine = u'\u2501'
         verticalLine = u'\u2503'
         topLeftCorner = u'\u250F'
@@ -20,8 +37,6 @@ class Tools(object):
         leftThreeWay = u'\u2523'
         rightThreeWay = u'\u252B'
         topThreeWay = u'\u2533'
-        bottomThreeWay = u'\u253B'
-        fourWay = u'\u254B'
         thinHorizontalLine = u'\u2500'
         thinVerticalLine = u'\u2502'
         thinFourWay = u'\u253C'
@@ -30,12 +45,15 @@ class Tools(object):
         thinThickBottomThreeWay = u'\u2537'
         thinThickTopFourWay = u'\u2547'
 
+        if stream is None:
+            stream = sys.stdout
+
         if objects == None:
-            print("None")
+            print("None", file=stream)
             return None
         try:
             if len(objects) == 0:
-                print("Empty")
+                print("Empty", file=stream)
                 return None
         except:
             pass
@@ -46,229 +64,124 @@ class Tools(object):
         except:
             objects = [objects]
 
-
-        #filter out specified variables DOES NOT WORK!
-        # try:
-        #     if objFilter != None:
-        #         objFilter = objFilter.split(',')
-        #         for afilter in objFilter:
-        #             for object in objects:
-        #                 del object.__dict__[afilter]
-        # except:
-        #     pass
         if objFilter != None:
             objFilter = objFilter.split(',')
         else:
             objFilter = []
 
+        #the columns come from the first object
+        keys = [key for key in vars(objects[0]) if key not in objFilter]
 
-        #get the individual spacer lengths
-        #numHeaders = len(vars(objects[0]))
-        #filter objects
-        #print vars(objects[0])
-        objVars = vars(objects[0])
-        filteredObjVars = []
-        for key in objVars:
-            #print key
-            if key in objFilter:
-                continue
-            filteredObjVars.append(key)
-        numHeaders = len(filteredObjVars)
-        #print filteredObjVars
-        #print numHeaders
-
-        #spacerHeaders = len(vars(objects[0]))
-
-        spacerLengths = []
-        for i in range(0, numHeaders):
-            #spacerLength = len(str(vars(objects[0]).keys()[i]))
-            spacerLength = len(str(filteredObjVars[i]))
+        if output_format == 'csv':
+            writer = csv.writer(stream)
+            writer.writerow(keys)
             for objecty in objects:
-                valueLength = len(str(vars(objecty)[filteredObjVars[i]]))
-                #valueLength = len(str(vars(objecty).values()[i]))
-                #valueLength = vars(objecty)[objFilter[i]]
-                if valueLength > spacerLength:
-                    spacerLength = valueLength
-            spacerLengths.append(spacerLength)
-        #print spacerLengths
+                objVars = vars(objecty)
+                writer.writerow([objVars[key] for key in keys])
+            return None
+        elif output_format == 'jsonl':
+            buffer = []
+            for objecty in objects:
+                objVars = vars(objecty)
+                buffer.append(json.dumps({key: objVars[key] for key in keys}, default=str))
+                if len(buffer) >= 4096:
+                    stream.write('\n'.join(buffer) + '\n')
+                    buffer = []
+            if buffer:
+                stream.write('\n'.join(buffer) + '\n')
+            return None
+        elif output_format != 'table':
+            raise ValueError("Unknown output format: {0}".format(output_format))
 
+        #convert every value to a string once and find the column widths in the same pass
+        spacerLengths = [len(str(key)) for key in keys]
+        rows = []
+        for objecty in objects:
+            objVars = vars(objecty)
+            row = [str(objVars[key]) for key in keys]
+            for i, value in enumerate(row):
+                if len(value) > spacerLengths[i]:
+                    spacerLengths[i] = len(value)
+            rows.append(row)
+
+        headerLength = sum(spacerLengths) + 3 * len(spacerLengths)
 
-        #computer header length
-        headerLength = 0
-        for spacerLength in spacerLengths:
-            headerLength = headerLength + spacerLength + 3
-        print()
+        def line(left, cross, right, fill):
+            return left + cross.join([fill * (spacerLength + 2) for spacerLength in spacerLengths]) + right
 
+        out = ['']
 
         # print the title if it exists
         if title != None:
             title = str(title)
-            # print the top title underline
-            header = topLeftCorner
-            for _ in range(1, headerLength):
-                header = header + horizontalLine
-            header = header + topRightCorner
-            print(header)
-
+            out.append(topLeftCorner + horizontalLine * (headerLength - 1) + topRightCorner)
             titleSpacerLength = int((headerLength / 2) - (len(title) / 2))
-            titleString = verticalLine
-            for _ in range(0, titleSpacerLength):
-                titleString = titleString + " "
-            titleString = titleString + title
-            for _ in range(1, titleSpacerLength):
-                titleString = titleString + " "
+            titleString = verticalLine + " " * titleSpacerLength + title + " " * (titleSpacerLength - 1)
             #fix length of spaces in title
             if len(titleString) > headerLength:
                 titleString = titleString[:-1]
-            elif len(titleString) > headerLength:
-                titleString = titleString + " "
-
-            titleString = titleString + " " + verticalLine
-            print(titleString)
-
-        #compute the cross section points
-        crossSectionPoints = []
-        lastSpacerLength = 0
-        for spacerLength in spacerLengths:
-            nextSpacerLength = (spacerLength + lastSpacerLength + 3)
-            crossSectionPoints.append(nextSpacerLength)
-            lastSpacerLength = nextSpacerLength
-
-
-        # print the top header underline
-        if title == None:
-            header = topLeftCorner
-        else:
-            header = leftThreeWay
-        curHeader = 0
-        for i in range(1, headerLength):
-            if i == crossSectionPoints[curHeader]:
-                header = header + topThreeWay
-                curHeader = curHeader + 1
-                if curHeader > (len(crossSectionPoints) - 1):
-                    curHeader = (len(crossSectionPoints) - 1)
-            else:
-                header = header + horizontalLine
-        if title == None:
-            header = header + topRightCorner
+            out.append(titleString + " " + verticalLine)
+            out.append(line(leftThreeWay, topThreeWay, rightThreeWay, horizontalLine))
         else:
-            header = header + rightThreeWay
-        print(header)
-
+            out.append(line(topLeftCorner, topThreeWay, topRightCorner, horizontalLine))
 
         #print the headers
-        print(verticalLine, end='')
-        i = 0
-        for key in vars(objects[0]):
-            #object filter
-            if key in objFilter:
-                continue
-
-            #spacer = spacerLengths[vars(objects[0]).keys().index(key)]
-            spacer = spacerLengths[i]
-
-            i = i + 1
-            spaceNum = spacer - len(str(key))
-            divider = " "
-            for _ in range(0, spaceNum):
-                divider = divider + " "
-            divider = divider + "" + verticalLine
-            print(" " + str(key).upper() + divider, end='')
-        print()
-
-
-        #print the bottom header underline
-        header = leftThreeWay
-        curHeader = 0
-        for i in range(1, headerLength):
-            if i == crossSectionPoints[curHeader]:
-                header = header + thinThickTopFourWay
-                curHeader = curHeader + 1
-                if curHeader > (len(crossSectionPoints) - 1):
-                    curHeader = (len(crossSectionPoints) - 1)
-            else:
-                header = header + horizontalLine
-        header = header + rightThreeWay
-        print(header)
-
+        out.append(verticalLine + "".join([" " + str(key).upper() + " " * (spacer - len(str(key)) + 1) + verticalLine
+                                           for key, spacer in zip(keys, spacerLengths)]))
+        out.append(line(leftThreeWay, thinThickTopFourWay, rightThreeWay, horizontalLine))
 
         #print the objects
-        for objecty in objects:
-            objecty = objecty.__dict__
-            print(verticalLine, end='')
-            i = 0
-            # for key, value in vars(objecty).iteritems():
-            for key in objecty:
-                # object filter
-                if key in objFilter:
-                    continue
-
-                #spaceNum = spacerLengths[vars(objects[0]).keys().index(key)] - len(str(value))
-                spaceNum = spacerLengths[i] - len(str(objecty[key]))
-
-                divider = " "
-                for _ in range(0, spaceNum):
-                    divider = divider + " "
-                divider = divider + " " + thinVerticalLine
-                # if vars(objecty).keys().index(key) == (len(vars(objecty).keys()) - 1) or key == filteredObjVars[len(filteredObjVars) - 1]:
-                #     divider = divider[:-1]
-                #     divider = divider + verticalLine
-                i = i + 1
-                print(str(objecty[key]) + divider, end='')
-            print()
-
-            # print the divider line
-            if dividers:
-                if objects.index(objecty) != (len(objects) - 1):
-                    header = thinThickLeftThreeWay
-                    curHeader = 0
-                    for i in range(1, headerLength):
-                        if i == crossSectionPoints[curHeader]:
-                            header = header + thinFourWay
-                            curHeader = curHeader + 1
-                            if curHeader > (len(crossSectionPoints) - 1):
-                                curHeader = (len(crossSectionPoints) - 1)
-                        else:
-                            header = header + thinHorizontalLine
-                    header = header + thinThickRightThreeWay
-                    print(header)
-
-
+        dividerLine = line(thinThickLeftThreeWay, thinFourWay, thinThickRightThreeWay, thinHorizontalLine)
+        lastRow = len(rows) - 1
+        for rowIndex, row in enumerate(rows):
+            out.append(verticalLine + "".join([value + " " * (spacer - len(value) + 2) + thinVerticalLine
+                                               for value, spacer in zip(row, spacerLengths)]))
+            if dividers and rowIndex != lastRow:
+                out.append(dividerLine)
+            if len(out) >= 4096:
+                stream.write('\n'.join(out) + '\n')
+                out = []
 
         # print the footer underline
-        header = bottomLeftCorner
-        curHeader = 0
-        for i in range(1, headerLength):
-            if i == crossSectionPoints[curHeader]:
-                header = header + thinThickBottomThreeWay
-                curHeader = curHeader + 1
-                if curHeader > (len(crossSectionPoints) - 1):
-                    curHeader = (len(crossSectionPoints) - 1)
-            else:
-                header = header + horizontalLine
-        header = header + bottomeRightCorner
-        print(header)
-        print()
+        out.append(line(bottomLeftCorner, thinThickBottomThreeWay, bottomeRightCorner, horizontalLine))
+        out.append('')
+        stream.write('\n'.join(out) + '\n')
+        stream.flush()
 
     @staticmethod
-    def get_folder_size(folder_path):
+    def get_folder_size(folder_path, walker=None):
         """
         Get the size of a folder in MB
         :param folder_path: path to folder
+        :param walker: a TreeWalker to walk the folder with, None for the default one
         :return: float
         """
-        total_size = os.path.getsize(folder_path)
-        for path, dirs, files in os.walk(folder_path):
-            for f in files:
-                fp = os.path.join(path, f)
-                try:
-                    total_size += os.path.getsize(fp)
-                except (FileNotFoundError, OSError):
-                    pass
-            for d in dirs:
-                fp = os.path.join(path, d)
-                try:
-                    total_size += os.path.getsize(fp)
-                except (FileNotFoundError, OSError):
-                    pass
-        return total_size / 1048576
+        return SubtreeQueue(walker=walker).get_folder_size(folder_path=folder_path)
+
+    @staticmethod
+    def write_json_file(file_path, json_data, indent=4, sort_keys=True):
+        """
+        Write a dictionary to a file in json format
+        :param file_path: Path to file to write
+        :param json_data: Dictionary to write
+        :param indent: Number of spaces to indent
+        :param sort_keys: Sort the dictionary before writing
+        :return: None
+        """
+        Tools.write_text_file(file_path=file_path,
+                              text_data=json.dumps(json_data, indent=indent, sort_keys=sort_keys))
+
+    @staticmethod
+    def write_text_file(file_path, text_data):
+        """
+        Write text to a file.
+        :param file_path: Path to file to write
+        :param text_data: Text to write to file
+        :return: None
+        """
+        file_path = os.path.abspath(file_path)
+        try:
+            with open(file_path, 'w') as write_file:
+                write_file.write(text_data)
+        except (FileExistsError, FileNotFoundError, PermissionError, OSError) as e:
+            print("{0} Failed to write file path: {1}".format(e, file_path))
@@ -0,0 +1,142 @@
+
+import os
+import stat
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .TreeWalker import TreeWalker
+from .IoThrottle import IoThrottle
+
+
+class DeleteResult(object):
+
+    def __init__(self, path):
+        """
+        Statistics about a single tree deletion
+        :param path: root of the deleted tree
+        """
+        self.path = path
+        self.files = 0
+        self.dirs = 0
+        self.errors = []
+        self.runtime = 0
+
+
+class TreeDeleter(object):
+
+    def __init__(self, threads=16, dry_run=False, batch_size=256, progress=None, walker=None, throttle=None):
+        """
+        Deletes directory trees in parallel. Files are unlinked from a thread pool while the tree is still being walked
+        and directories are removed bottom-up once all of the files below them are gone. Over NFS every unlink is a
+        round trip, so keeping many of them in flight is much faster than shutil.rmtree.
+        :param threads: number of threads in the pool
+        :param dry_run: walk the tree and count what would be removed without removing anything
+        :param batch_size: number of files handed to a thread at a time
+        :param progress: print progress every so many files, None to disable
+        :param walker: a TreeWalker to walk the tree with, None for one that does not stat the entries
+        :param throttle: an IoThrottle to draw unlinks and rmdirs from, None for no limit
+        """
+        self.threads = threads
+        self.dry_run = dry_run
+        self.batch_size = batch_size
+        self.progress = progress
+        self.throttle = throttle or IoThrottle()
+        self.walker = walker or TreeWalker(stat_entries=False, throttle=self.throttle)
+
+    def delete(self, path):
+        """
+        Delete a directory tree
+        :param path: root of the tree to delete
+        :return: a DeleteResult object
+        """
+        start_time = time()
+        result = DeleteResult(path=path)
+        dirs_by_depth = []
+        futures = []
+
+        # scandir follows a symlinked root, so refuse it like shutil.rmtree does instead of emptying the link target
+        try:
+            is_link = stat.S_ISLNK(os.lstat(path).st_mode)
+        except OSError as e:
+            result.errors.append((path, str(e)))
+            return result
+        if is_link:
+            result.errors.append((path, 'Cannot delete a symbolic link'))
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            # walk top-down, unlinking files in inode order as soon as their directory has been read
+            batch = []
+            top = os.path.normpath(path)
+            root_depth = top.count(os.sep)
+            for dir_path, dirs, files in self.walker.walk(top, onerror=lambda p, e: result.errors.append((p, str(e)))):
+                depth = dir_path.count(os.sep) - root_depth
+                while len(dirs_by_depth) <= depth:
+                    dirs_by_depth.append([])
+                dirs_by_depth[depth].append(dir_path)
+                # symlinks to directories are not walked, they are unlinked like files
+                for entry in files + [entry for entry in dirs if entry.is_symlink()]:
+                    batch.append(entry.path)
+                    if len(batch) >= self.batch_size:
+                        futures.append(executor.submit(self._unlink_files, batch))
+                        batch = []
+            if batch:
+                futures.append(executor.submit(self._unlink_files, batch))
+
+            for future in futures:
+                files, errors = future.result()
+                result.files += files
+                result.errors.extend(errors)
+                if self.progress and result.files // self.progress != (result.files - files) // self.progress:
+                    action = 'Counted' if self.dry_run else 'Removed'
+                    print('{0} {1:08d} files from {2}'.format(action, result.files, path), end='\r')
+
+            # directories at the same depth can not contain each other, so each level is removed in parallel
+            for depth_dirs in reversed(dirs_by_depth):
+                for removed, error in executor.map(self._remove_dir, depth_dirs):
+                    result.dirs += removed
+                    if error:
+                        result.errors.append(error)
+
+        if self.progress and result.files >= self.progress:
+            print()
+        result.runtime = time() - start_time
+        return result
+
+    def _unlink_files(self, file_paths):
+        """
+        Unlink a batch of files
+        :param file_paths: a list of paths
+        :return: (number of files removed, list of (path, error) tuples)
+        """
+        if self.dry_run:
+            return len(file_paths), []
+        self.throttle.metadata(count=len(file_paths))
+        removed = 0
+        errors = []
+        for file_path in file_paths:
+            try:
+                os.unlink(file_path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                errors.append((file_path, str(e)))
+        return removed, errors
+
+    def _remove_dir(self, dir_path):
+        """
+        Remove a single empty directory
+        :param dir_path: path to the directory
+        :return: (number of directories removed, (path, error) tuple or None)
+        """
+        if self.dry_run:
+            return 1, None
+        self.throttle.metadata()
+        try:
+            os.rmdir(dir_path)
+            return 1, None
+        except FileNotFoundError:
+            return 0, None
+        except OSError as e:
+            return 0, (dir_path, str(e))
@@ -0,0 +1,97 @@
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .IoThrottle import IoThrottle
+
+
+class TreeWalker(object):
+
+    def __init__(self, prefetch_threads=4, prefetch_dirs=32, stat_entries=True, follow_symlinks=True, throttle=None):
+        """
+        Walks directory trees like os.walk, but visits the entries of each directory in inode order and reads the
+        directories that are coming up next from a small thread pool while the current one is being worked on. On
+        spinning disks the inodes of a directory's entries are usually laid out in creation order, so stat, open and
+        unlink in inode order turn random seeks across the inode table into mostly sequential reads, and prefetching
+        keeps the disk busy while the caller is working.
+        :param prefetch_threads: number of threads reading upcoming directories, 0 to read each directory when visited
+        :param prefetch_dirs: number of upcoming directories to read ahead
+        :param stat_entries: stat every entry in inode order while reading a directory, the result is cached on the
+            entry so entry.stat() does not go back to the disk
+        :param follow_symlinks: follow symlinks when stating entries, should match what the caller stats
+        :param throttle: an IoThrottle to draw directory reads and stats from, None for no limit
+        """
+        self.prefetch_threads = prefetch_threads
+        self.prefetch_dirs = prefetch_dirs
+        self.stat_entries = stat_entries
+        self.follow_symlinks = follow_symlinks
+        self.throttle = throttle or IoThrottle()
+
+    def walk(self, top, onerror=None, split=None):
+        """
+        Walk a directory tree top-down. Like os.walk, removing entries from dirs stops them from being walked, and
+        symlinks to directories are listed in dirs but not walked.
+        :param top: root of the tree
+        :param onerror: function called with (path, OSError) when a directory can not be read, errors are ignored if
+            None
+        :param split: function called with the list of directories still waiting to be walked after each directory,
+            if it returns True the walk stops and those directories are left to the caller
+        :return: a generator of (dir_path, dirs, files) where dirs and files are lists of os.DirEntry objects sorted
+            by inode
+        """
+        executor = ThreadPoolExecutor(max_workers=self.prefetch_threads) if self.prefetch_threads else None
+        pending = {}
+        stack = [top]
+        try:
+            while stack:
+                dir_path = stack.pop()
+                future = pending.pop(dir_path, None)
+                try:
+                    dirs, files = future.result() if future else self.scan(dir_path)
+                except OSError as e:
+                    if onerror:
+                        onerror(dir_path, e)
+                    continue
+
+                yield dir_path, dirs, files
+
+                # pushed in reverse so the directory with the lowest inode is visited next
+                stack.extend(entry.path for entry in reversed(dirs) if not entry.is_symlink())
+                if split and stack and split(stack):
+                    return
+                if executor:
+                    for upcoming in stack[-self.prefetch_dirs:]:
+                        if upcoming not in pending:
+                            pending[upcoming] = executor.submit(self.scan, upcoming)
+        finally:
+            if executor:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def scan(self, dir_path):
+        """
+        Read a single directory
+        :param dir_path: path to the directory
+        :return: (dirs, files) lists of os.DirEntry objects sorted by inode
+        """
+        self.throttle.metadata()
+        with os.scandir(dir_path) as entries:
+            entries = sorted(entries, key=lambda entry: entry.inode())
+        if self.stat_entries:
+            self.throttle.metadata(count=len(entries))
+        dirs = []
+        files = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if self.stat_entries:
+                try:
+                    entry.stat(follow_symlinks=self.follow_symlinks)
+                except OSError:
+                    pass
+            if is_dir:
+                dirs.append(entry)
+            else:
+                files.append(entry)
+        return dirs, files
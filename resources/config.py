@@ -6,6 +6,7 @@ config = {
     'data_retention_months_after_access': 24,
     'data_retention_months_of_archive': 12,
     'print_user_info': True,
+    'user_report_format': None,  # csv | jsonl, set to None to disable
     'confirm_before_archive': False,
     'disable_archiving': False,
     'file_ignore_filter': 'aquota.user,lost+found',
@@ -14,4 +15,35 @@ config = {
     'verbose_username': True,
     'process_threads': 50,
     'max_archive_size': 30000,  # max archive size in MB before compression
+    'archive_format': 'zip',  # zip | tar | gztar | bztar | xztar
+    'zip_compression': 'deflate',  # deflate | lzma | bzip2, for files that are worth compressing
+    'zip_store_extensions': '.zip,.gz,.tgz,.bz2,.xz,.7z,.rar,.jar,.docx,.xlsx,.pptx,.odt,.jpg,.jpeg,.png,.gif,.webp,'
+                            '.heic,.mp3,.m4a,.aac,.ogg,.flac,.mp4,.m4v,.mov,.mkv,.avi,.webm,.ova,.pdf',
+    'zip_sample_size': 65536,  # bytes of each file compressed as a sample, set to None to disable sampling
+    'zip_sample_ratio': 0.95,  # store files whose sample does not compress below this ratio
+    'restore_threads': 8,
+    'io_read_limit': None,  # bytes per second read from user data and archives, None for no limit
+    'io_write_limit': None,  # bytes per second written to archives, None for no limit
+    'io_metadata_limit': None,  # directory reads, stats, unlinks and rmdirs per second, None for no limit
+    'io_limit_schedule': [],  # e.g. [{'start': '08:00', 'end': '18:00', 'read': 20000000, 'metadata': 2000}]
+    'walk_prefetch_threads': 4,  # threads reading upcoming directories while a tree is walked, 0 to disable
+    'walk_prefetch_dirs': 32,
+    'split_files': 100000,  # entries a folder walk may look at before it is split across threads, None to disable
+    'split_seconds': 30,  # seconds a folder walk may run before it is split across threads, None to disable
+    'verify_archive': True,  # read each archive back and only remove the data of users whose files match
+    'verify_sha256': False,  # also record and check a SHA-256 of every file, CRC32 is always used
+    'verify_threads': 8,
+    'delete_threads': 16,
+    'delete_dry_run': False,  # walk and count archived user data without removing it
+    'schedule_index_path': None,  # set to a file path to only check users whose retention could have lapsed
+    'schedule_recheck_days': 30,
+    'daemon_socket_path': '/run/student_data_retention_enforcer.sock',
+    'daemon_run_time': '02:00',  # time of day for daemon archive runs, set to None to disable
+    'daemon_ldap_connections': 2,
+    'daemon_cache_seconds': 3600,
+    'shard_queue_path': None,  # shared directory for sharded runs
+    'shard_count': 64,
+    'shard_method': 'hash',  # hash | range
+    'shard_workers': 4,  # worker processes for a local sharded run
+    'shard_lock_timeout': 3600,  # seconds before a shard claimed by a dead worker can be claimed again
 }